@@ -1,10 +1,513 @@
+import argparse
+import base64
+import csv
+import gzip
+import hashlib
+import hmac
+import io
 import json
 import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import wraps
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 import secrets
 import bcrypt
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
+from psycopg2.extras import RealDictCursor, execute_values
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '1') != '0'
+
+# Фазы текущего запроса: имя -> секунды. Поток на запрос, поэтому thread-local.
+_timing = threading.local()
+
+
+@contextmanager
+def timed(phase: str):
+    """Добавляет длительность блока к фазе текущего запроса (Server-Timing и лог запроса).
+    Фазы не пересекаются: запросы к БД внутри фазы считаются в неё, а не в db."""
+    phases = getattr(_timing, 'phases', None)
+    if phases is None or _timing.phase is not None:
+        yield
+        return
+    _timing.phase = phase
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - started
+        _timing.phase = None
+
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_SAMPLE = float(os.environ.get('SLOW_QUERY_SAMPLE', '0.1'))
+SLOW_QUERY_COOLDOWN = float(os.environ.get('SLOW_QUERY_COOLDOWN', '300'))
+
+# Когда последний раз снимали план для текста запроса - не чаще раза в SLOW_QUERY_COOLDOWN
+_explained = {}
+_explained_lock = threading.Lock()
+
+
+def param_shape(vars):
+    """Типы параметров без значений - чтобы в лог не попадали токены и персональные данные"""
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {key: type(value).__name__ for key, value in vars.items()}
+    return [type(value).__name__ for value in vars]
+
+
+def should_explain(text: str) -> bool:
+    if random.random() >= SLOW_QUERY_SAMPLE:
+        return False
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(text, -SLOW_QUERY_COOLDOWN) < SLOW_QUERY_COOLDOWN:
+            return False
+        _explained[text] = now
+        if len(_explained) > 1000:
+            _explained.clear()
+    return True
+
+
+EXPLAINABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def is_explainable(query: str) -> bool:
+    """Одиночный SELECT/INSERT/UPDATE/DELETE/WITH. В тексте из нескольких команд EXPLAIN покрыл бы
+    только первую, а остальные выполнились бы второй раз по-настоящему - такие запросы не трогаем."""
+    text = query.strip().rstrip(';')
+    if ';' in text:
+        return False
+    words = text.split(None, 1)
+    return bool(words) and words[0].upper() in EXPLAINABLE_STATEMENTS
+
+
+def explain_query(conn, query, vars) -> str:
+    """План медленного запроса. ANALYZE только для SELECT: запись нельзя выполнять второй раз,
+    для неё - обычный EXPLAIN. В открытой транзакции план снимается под savepoint,
+    чтобы ошибка EXPLAIN её не сломала."""
+    analyze = query.lstrip().upper().startswith('SELECT')
+    prefix = 'EXPLAIN (ANALYZE, BUFFERS)' if analyze else 'EXPLAIN'
+    in_transaction = not conn.autocommit and conn.info.transaction_status != TRANSACTION_STATUS_IDLE
+    cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        if in_transaction:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(f'{prefix} {query}', vars)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        except psycopg2.Error as e:
+            plan = f'EXPLAIN не удался: {e}'
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+        if in_transaction:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+    finally:
+        cursor.close()
+    return plan
+
+
+def log_slow_query(conn, query, vars, elapsed: float) -> None:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = query.as_string(conn)
+    text = ' '.join(query.split())
+    entry = {
+        'event': 'slow_query',
+        'duration_ms': round(elapsed * 1000, 1),
+        'query': text[:2000],
+        'params': param_shape(vars)
+    }
+    if is_explainable(query) and should_explain(text):
+        entry['plan'] = explain_query(conn, query, vars)
+    print(json.dumps(entry, ensure_ascii=False))
+
+
+class TimedCursorMixin:
+    """Время каждого запроса к БД идёт в фазу db, число запросов и прочитанных строк - в лог запроса.
+    Запросы дольше SLOW_QUERY_MS пишутся в лог медленных запросов."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        with timed('db'):
+            result = super().execute(query, vars)
+        elapsed = time.perf_counter() - started
+        if getattr(_timing, 'phases', None) is not None:
+            _timing.queries += 1
+            if self.description is not None:
+                _timing.rows += max(self.rowcount, 0)
+        # Для именованных курсоров execute - только DECLARE, строки читаются позже
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS and not self.name:
+            log_slow_query(self.connection, query, vars, elapsed)
+        return result
+
+
+class TimedCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or TimedCursor
+        kwargs['cursor_factory'] = TimedRealDictCursor if factory is RealDictCursor else factory
+        return super().cursor(*args, **kwargs)
+
+
+def timed_handler(function: str):
+    """Замеряет фазы запроса: пишет JSON-строку в лог и добавляет заголовок Server-Timing"""
+    def decorate(handler):
+        @wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            if not REQUEST_TIMING:
+                return handler(event, context)
+            _timing.phases = {}
+            _timing.phase = None
+            _timing.rows = 0
+            _timing.queries = 0
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+                total = time.perf_counter() - started
+                phases, rows, queries = _timing.phases, _timing.rows, _timing.queries
+            finally:
+                _timing.phases = None
+            
+            # app - всё, что не попало в фазы: логика обработчика и чтение строк
+            phases['app'] = max(total - sum(phases.values()), 0.0)
+            metrics = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in phases.items()]
+            metrics.append(f'total;dur={total * 1000:.1f}')
+            metrics.append(f'queries;desc="{queries}"')
+            print(json.dumps({
+                'event': 'request',
+                'function': function,
+                'method': event.get('httpMethod'),
+                'action': (event.get('queryStringParameters') or {}).get('action', ''),
+                'status': response.get('statusCode'),
+                'duration_ms': round(total * 1000, 1),
+                'phases': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+                'rows': rows,
+                'queries': queries
+            }))
+            return {
+                **response,
+                'headers': {
+                    **(response.get('headers') or {}),
+                    'Server-Timing': ', '.join(metrics),
+                    'Timing-Allow-Origin': '*'
+                }
+            }
+        return wrapper
+    return decorate
+
+
+# Общие заголовки JSON-ответов. Один экземпляр на все ответы - не изменять на месте,
+# дополнительные заголовки передаются в json_response и сливаются в новый словарь.
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def json_default(value):
+    """Типы из psycopg2, которых не знает json: NUMERIC -> число, даты -> ISO 8601"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Тип {type(value).__name__} не сериализуется в JSON')
+
+
+_json_encoder = json.JSONEncoder(default=json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(data) -> str:
+    """Сериализация тела ответа: orjson, если установлен, иначе стандартный json с тем же результатом"""
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return _json_encoder.encode(data)
+
+
+def json_response(status: int, data, headers: dict = None) -> dict:
+    with timed('serialize'):
+        body = dumps(data)
+    return {
+        'statusCode': status,
+        'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+
+class ConnectionPool:
+    """Пул соединений с БД уровня модуля - живёт между вызовами в тёплом инстансе функции.
+    Ограничивает число соединений, проверяет простаивавшие соединения перед выдачей
+    и сбрасывает (rollback/закрытие) соединения при возврате."""
+
+    def __init__(self, dsn: str, maxconn: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def getconn(self, timeout: float = None):
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise PoolError('Пул соединений с БД исчерпан')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+                conn, released_at = item
+                if self._is_healthy(conn, released_at):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if self._reset(conn):
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reset(self, conn) -> bool:
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status == TRANSACTION_STATUS_IDLE:
+            return True
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'], DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Выдаёт соединение из пула и всегда возвращает его обратно, даже при исключении"""
+    pool = get_pool()
+    with timed('connect'):
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '1024'))
+SESSION_CACHE_SYNC_INTERVAL = float(os.environ.get('SESSION_CACHE_SYNC_INTERVAL', '2'))
+
+
+class SessionCache:
+    """LRU-кэш token -> пользователь с ограниченным временем жизни записей.
+    Запись живёт не дольше SESSION_CACHE_TTL и никогда не переживает expires_at сессии."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            user, deadline = item
+            if deadline <= time.monotonic():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return dict(user)
+
+    def put(self, token: str, user: dict, expires_at: datetime) -> None:
+        ttl = min(self.ttl, (expires_at - datetime.now()).total_seconds())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[token] = (dict(user), time.monotonic() + ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._items.pop(token, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in [t for t, (u, _) in self._items.items() if u['id'] == user_id]:
+                del self._items[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+_session_generation = (None, 0.0)
+
+# Выход, смена пароля и правка пользователя сдвигают счётчик, и кэши сессий во всех функциях сбрасываются
+BUMP_SESSION_GENERATION = "UPDATE cache_generations SET generation = generation + 1 WHERE name = 'sessions'"
+
+ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', '100'))
+ADMIN_PAGE_MAX = int(os.environ.get('ADMIN_PAGE_MAX', '500'))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '2000'))
+# Предел сжатой выгрузки через HTTP: ответ целиком держится в памяти функции и ещё раз в base64
+EXPORT_HTTP_MAX_BYTES = int(os.environ.get('EXPORT_HTTP_MAX_BYTES', str(4 * 1024 * 1024)))
+SESSION_PURGE_CHUNK = int(os.environ.get('SESSION_PURGE_CHUNK', '5000'))
+SESSION_PURGE_MAX_CHUNKS = int(os.environ.get('SESSION_PURGE_MAX_CHUNKS', '20'))
+SUBSCRIPTION_SWEEP_CHUNK = int(os.environ.get('SUBSCRIPTION_SWEEP_CHUNK', '1000'))
+SUBSCRIPTION_SWEEP_MAX_CHUNKS = int(os.environ.get('SUBSCRIPTION_SWEEP_MAX_CHUNKS', '20'))
+ADMIN_BULK_MAX = int(os.environ.get('ADMIN_BULK_MAX', '500'))
+# Сколько строк dashboard_stats_deltas копится до того, как get_stats свернёт их в dashboard_stats
+DASHBOARD_FOLD_AFTER = int(os.environ.get('DASHBOARD_FOLD_AFTER', '1000'))
+USER_IMPORT_MAX = int(os.environ.get('USER_IMPORT_MAX', '2000'))
+USER_IMPORT_BATCH = int(os.environ.get('USER_IMPORT_BATCH', '500'))
+# Процессов для bcrypt при импорте пользователей; 0 - по числу доступных ядер
+USER_IMPORT_PROCESSES = int(os.environ.get('USER_IMPORT_PROCESSES', '0'))
+ACCESS_TOKEN_SECRET = os.environ.get('ACCESS_TOKEN_SECRET', '')
+
+
+def sync_session_cache(conn) -> None:
+    """Сбрасывает кэш сессий, если сессии или пользователи менялись в другом инстансе
+    (счётчик cache_generations.sessions). Счётчик читается не чаще раза в SESSION_CACHE_SYNC_INTERVAL секунд."""
+    global _session_generation
+    generation, checked_at = _session_generation
+    if time.monotonic() - checked_at < SESSION_CACHE_SYNC_INTERVAL:
+        return
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT generation FROM cache_generations WHERE name = 'sessions'")
+    row = cursor.fetchone()
+    cursor.close()
+    
+    current = row[0] if row else 0
+    if current != generation:
+        _session_cache.clear()
+    _session_generation = (current, time.monotonic())
+
+
+def resolve_session(conn, token: str):
+    """Возвращает пользователя по токену сессии: сначала из кэша, при промахе - из БД"""
+    with timed('session'):
+        sync_session_cache(conn)
+    user = _session_cache.get(token)
+    if user is not None:
+        return user
+    
+    with timed('session'):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT u.id, u.email, u.full_name, u.phone, u.role, s.expires_at
+            FROM users u
+            JOIN sessions s ON u.id = s.user_id
+            WHERE s.token = %s AND s.expires_at > NOW()
+        """, (token,))
+        row = cursor.fetchone()
+        cursor.close()
+    
+    if not row:
+        return None
+    
+    user = {
+        'id': row['id'],
+        'email': row['email'],
+        'full_name': row['full_name'],
+        'phone': row['phone'],
+        'role': row['role']
+    }
+    _session_cache.put(token, user, row['expires_at'])
+    return user
+
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '2'))
+
+_bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt') if BCRYPT_WORKERS > 0 else None
+
+
+def run_bcrypt(fn, *args):
+    """Выполняет bcrypt в ограниченном пуле потоков (bcrypt отпускает GIL на время хеширования),
+    чтобы медленный хеш не блокировал другие запросы; при BCRYPT_WORKERS=0 - в текущем потоке"""
+    with timed('bcrypt'):
+        if _bcrypt_executor is None:
+            return fn(*args)
+        return _bcrypt_executor.submit(fn, *args).result()
+
+
+def hash_password(password: str) -> str:
+    return run_bcrypt(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+@timed_handler('admin')
 def handler(event: dict, context) -> dict:
     """API для админ-панели - управление контентом, пользователями, продуктами и заказами"""
     method = event.get('httpMethod', 'GET')
@@ -22,96 +525,85 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    action = event.get('queryStringParameters', {}).get('action', '')
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action', '')
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        
-        if method == 'GET' and action == 'content':
-            return get_site_content(conn)
+        with db_connection() as conn:
         
-        headers = event.get('headers', {})
-        token = headers.get('x-authorization', '') or headers.get('X-Authorization', '')
-        token = token.replace('Bearer ', '')
+            if method == 'GET' and action == 'content':
+                return get_site_content(conn)
         
-        if not token:
-            conn.close()
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Требуется авторизация'}),
-                'isBase64Encoded': False
-            }
+            headers = event.get('headers', {})
+            token = headers.get('x-authorization', '') or headers.get('X-Authorization', '')
+            token = token.replace('Bearer ', '')
         
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+            if not token:
+                return json_response(401, {'error': 'Требуется авторизация'})
         
-        cursor.execute("""
-            SELECT u.id, u.role 
-            FROM users u
-            JOIN sessions s ON u.id = s.user_id
-            WHERE s.token = %s AND s.expires_at > NOW()
-        """, (token,))
+            user = resolve_session(conn, token)
         
-        user = cursor.fetchone()
-        cursor.close()
+            if not user or user['role'] != 'admin':
+                return json_response(403, {'error': 'Доступ запрещен. Требуются права администратора'})
         
-        if not user or user['role'] != 'admin':
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Доступ запрещен. Требуются права администратора'}),
-                'isBase64Encoded': False
-            }
+            if method == 'GET':
+                if action == 'content':
+                    return get_site_content(conn)
+                elif action == 'users':
+                    return get_users(conn, params)
+                elif action == 'products':
+                    return get_all_products(conn, params)
+                elif action == 'stats':
+                    return get_stats(conn)
+                elif action == 'get-orders':
+                    return get_orders(conn, params)
+                elif action == 'export':
+                    return export_data(conn, params)
+                elif action == 'analytics':
+                    return get_analytics(conn, params)
         
-        if method == 'GET':
-            if action == 'content':
-                return get_site_content(conn)
-            elif action == 'users':
-                return get_users(conn)
-            elif action == 'products':
-                return get_all_products(conn)
-            elif action == 'stats':
-                return get_stats(conn)
-            elif action == 'get-orders':
-                return get_orders(conn)
+            elif method == 'POST' and action == 'import-catalog':
+                return import_catalog_request(conn, event, params)
         
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            if action == 'content':
-                return update_content(conn, body, user['id'])
-            elif action == 'product':
-                return create_product(conn, body)
-            elif action == 'confirm-payment':
-                return admin_confirm_payment(conn, body)
+            elif method == 'POST':
+                body = json.loads(event.get('body', '{}'))
+                if action == 'content':
+                    return update_content(conn, body, user['id'])
+                elif action == 'product':
+                    return create_product(conn, body)
+                elif action == 'confirm-payment':
+                    return admin_confirm_payment(conn, body)
+                elif action == 'confirm-payments':
+                    return bulk_confirm_payments(conn, body)
+                elif action == 'rebuild-catalog':
+                    return rebuild_catalog(conn)
+                elif action == 'recompute-stats':
+                    return recompute_stats(conn)
+                elif action == 'purge-sessions':
+                    return purge_sessions(conn)
+                elif action == 'expire-subscriptions':
+                    return expire_subscriptions(conn)
+                elif action == 'import-users':
+                    return import_users_request(conn, body)
         
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            if action == 'product':
-                return update_product(conn, body)
-            elif action == 'update-order':
-                return update_order(conn, body)
-            elif action == 'user':
-                return update_user(conn, body)
-            elif action == 'reset-password':
-                return reset_user_password(conn, body)
+            elif method == 'PUT':
+                body = json.loads(event.get('body', '{}'))
+                if action == 'product':
+                    return update_product(conn, body)
+                elif action == 'update-order':
+                    return update_order(conn, body)
+                elif action == 'update-orders':
+                    return bulk_update_orders(conn, body)
+                elif action == 'user':
+                    return update_user(conn, body)
+                elif action == 'reset-password':
+                    return reset_user_password(conn, body)
         
-        conn.close()
         
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
+            return json_response(404, {'error': 'Endpoint not found'})
         
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return json_response(500, {'error': str(e)})
 
 
 def get_site_content(conn) -> dict:
@@ -120,12 +612,7 @@ def get_site_content(conn) -> dict:
     content = cursor.fetchall()
     cursor.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'content': [dict(c) for c in content]}, default=str),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'content': [dict(c) for c in content]})
 
 
 def update_content(conn, body: dict, user_id: int) -> dict:
@@ -146,38 +633,112 @@ def update_content(conn, body: dict, user_id: int) -> dict:
     conn.commit()
     cursor.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Контент обновлен'}),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'message': 'Контент обновлен'})
+
+
+# created_at допускает NULL: keyset и сортировка идут по COALESCE(created_at, TIMESTAMP 'epoch'),
+# иначе такие строки выпадают из сравнения кортежей (индексы - V0019)
+PAGE_EPOCH = datetime(1970, 1, 1)
+
+
+def parse_page_params(params: dict):
+    """Размер страницы и курсор (created_at, id) из query-параметров; ValueError при ошибке"""
+    limit = min(max(int(params.get('limit') or ADMIN_PAGE_SIZE), 1), ADMIN_PAGE_MAX)
+    cursor = params.get('cursor')
+    if not cursor:
+        return limit, None
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+    return limit, (datetime.fromisoformat(created_at), int(row_id))
+
+
+def paginate(rows: list, limit: int):
+    """Отрезает лишнюю строку (запрашивается limit + 1) и строит курсор следующей страницы"""
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    created_at = last['created_at'] or PAGE_EPOCH
+    next_cursor = base64.urlsafe_b64encode(f"{created_at.isoformat()}|{last['id']}".encode('utf-8'))
+    return rows[:limit], next_cursor.decode('ascii')
+
+
+def bad_page_params_response() -> dict:
+    return json_response(400, {'error': 'Некорректные параметры фильтрации или пагинации'})
+
 
+def like_pattern(term: str) -> str:
+    """Подстрока для ILIKE: спецсимволы шаблона экранируются"""
+    escaped = term.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
 
-def get_users(conn) -> dict:
+
+def user_filters(params: dict):
+    """Условия WHERE по фильтрам пользователей: role, date_from/date_to по created_at,
+    search - подстрока email, имени или телефона"""
+    conditions, args = [], []
+    if params.get('search'):
+        conditions.append('(u.email ILIKE %s OR u.full_name ILIKE %s OR u.phone ILIKE %s)')
+        args.extend([like_pattern(params['search'])] * 3)
+    if params.get('role'):
+        conditions.append('u.role = %s')
+        args.append(params['role'])
+    if params.get('date_from'):
+        conditions.append('u.created_at >= %s')
+        args.append(datetime.fromisoformat(params['date_from']))
+    if params.get('date_to'):
+        conditions.append('u.created_at < %s')
+        args.append(datetime.fromisoformat(params['date_to']))
+    return conditions, args
+
+
+def get_users(conn, params: dict) -> dict:
+    """Пользователи постранично (keyset по created_at, id) с фильтрами из user_filters"""
+    try:
+        limit, after = parse_page_params(params)
+        conditions, args = user_filters(params)
+    except ValueError:
+        return bad_page_params_response()
+    
+    if after:
+        conditions.append("(COALESCE(u.created_at, TIMESTAMP 'epoch'), u.id) < (%s, %s)")
+        args.extend(after)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT u.id, u.email, u.full_name, u.phone, u.role, u.created_at,
                w.balance
         FROM users u
         LEFT JOIN wallets w ON u.id = w.user_id
-        ORDER BY u.created_at DESC
-    """)
-    users = cursor.fetchall()
+        {where}
+        ORDER BY COALESCE(u.created_at, TIMESTAMP 'epoch') DESC, u.id DESC
+        LIMIT %s
+    """, (*args, limit + 1))
+    users, next_cursor = paginate(cursor.fetchall(), limit)
     cursor.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'users': [dict(u) for u in users]}, default=str),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'users': [dict(u) for u in users], 'next_cursor': next_cursor})
 
 
-def get_all_products(conn) -> dict:
+def get_all_products(conn, params: dict) -> dict:
+    """Все продукты (включая неактивные) постранично, keyset по created_at, id"""
+    try:
+        limit, after = parse_page_params(params)
+    except ValueError:
+        return bad_page_params_response()
+    
+    where, args = '', []
+    if after:
+        where = "WHERE (COALESCE(created_at, TIMESTAMP 'epoch'), id) < (%s, %s)"
+        args.extend(after)
+    
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT * FROM products ORDER BY created_at DESC")
-    products = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT * FROM products
+        {where}
+        ORDER BY COALESCE(created_at, TIMESTAMP 'epoch') DESC, id DESC
+        LIMIT %s
+    """, (*args, limit + 1))
+    products, next_cursor = paginate(cursor.fetchall(), limit)
     cursor.close()
     
     result = []
@@ -187,12 +748,7 @@ def get_all_products(conn) -> dict:
             d['upgrades'] = []
         result.append(d)
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'products': result}, default=str),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'products': result, 'next_cursor': next_cursor})
 
 
 def create_product(conn, body: dict) -> dict:
@@ -209,6 +765,7 @@ def create_product(conn, body: dict) -> dict:
         INSERT INTO products (title, description, price, category, image_url, is_active,
                               website_url, demo_url, subscription_days, upgrades, is_subscription)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
     """, (
         body.get('title'),
         body.get('description'),
@@ -222,16 +779,13 @@ def create_product(conn, body: dict) -> dict:
         jsonlib.dumps(upgrades),
         body.get('is_subscription', True)
     ))
+    product_id = cursor.fetchone()[0]
     
+    rebuild_catalog_snapshot(conn, product_id)
     conn.commit()
     cursor.close()
     
-    return {
-        'statusCode': 201,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Продукт создан'}),
-        'isBase64Encoded': False
-    }
+    return json_response(201, {'message': 'Продукт создан'})
 
 
 def update_product(conn, body: dict) -> dict:
@@ -267,57 +821,380 @@ def update_product(conn, body: dict) -> dict:
         product_id
     ))
     
+    rebuild_catalog_snapshot(conn, product_id)
     conn.commit()
     cursor.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Продукт обновлен'}),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'message': 'Продукт обновлен'})
 
 
-def get_stats(conn) -> dict:
+# Ключ advisory-блокировки перестройки catalog_snapshots
+CATALOG_SNAPSHOT_LOCK = 7_000_001
+
+
+def rebuild_catalog_snapshot(conn, product_id=None) -> None:
+    """Перестраивает готовые тела ответов витрины в catalog_snapshots в текущей транзакции.
+    Список перестраивается всегда, карточки - только для product_id (или для всех, если не указан).
+    Перестройки идут по одной: блокировка до конца транзакции, и products читается уже после неё,
+    поэтому вторая из параллельных записей видит изменения первой и не затирает их в 'list'."""
     cursor = conn.cursor(cursor_factory=RealDictCursor)
+    snapshots = []
+    
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (CATALOG_SNAPSHOT_LOCK,))
     
-    cursor.execute("SELECT COUNT(*) as total FROM users")
-    users_count = cursor.fetchone()['total']
+    cursor.execute("""
+        SELECT id, title, description, price, category, image_url, demo_url, is_active, created_at
+        FROM products
+        WHERE is_active = true
+        ORDER BY created_at DESC
+    """)
+    snapshots.append(('list', dumps({'products': cursor.fetchall()})))
     
-    cursor.execute("SELECT COUNT(*) as total FROM products WHERE is_active = TRUE")
-    products_count = cursor.fetchone()['total']
+    if product_id is None:
+        cursor.execute("DELETE FROM catalog_snapshots WHERE key <> 'list'")
+        cursor.execute("""
+            SELECT id, title, description, price, category, image_url, demo_url, is_active, created_at,
+                   subscription_days, upgrades, is_subscription
+            FROM products WHERE is_active = TRUE
+        """)
+    else:
+        cursor.execute("""
+            DELETE FROM catalog_snapshots WHERE key IN (%s, %s)
+        """, (f'product:{product_id}', f'payment-info:{product_id}'))
+        cursor.execute("""
+            SELECT id, title, description, price, category, image_url, demo_url, is_active, created_at,
+                   subscription_days, upgrades, is_subscription
+            FROM products WHERE id = %s AND is_active = TRUE
+        """, (product_id,))
     
-    cursor.execute("SELECT COUNT(*) as total FROM orders")
-    orders_count = cursor.fetchone()['total']
+    for p in cursor.fetchall():
+        detail = {k: p[k] for k in ('id', 'title', 'description', 'price', 'category', 'image_url',
+                                    'demo_url', 'is_active', 'created_at')}
+        payment = {k: p[k] for k in ('id', 'title', 'description', 'price', 'category', 'image_url',
+                                     'subscription_days', 'upgrades', 'is_subscription')}
+        if payment['upgrades'] is None:
+            payment['upgrades'] = []
+        snapshots.append((f"product:{p['id']}", dumps({'product': detail})))
+        snapshots.append((f"payment-info:{p['id']}", dumps({'product': payment})))
     
-    cursor.execute("SELECT COALESCE(SUM(total_amount), 0) as total FROM orders WHERE status = 'paid' OR payment_confirmed = TRUE")
-    revenue = cursor.fetchone()['total']
+    execute_values(cursor, """
+        INSERT INTO catalog_snapshots (key, version, body)
+        VALUES %s
+        ON CONFLICT (key) DO UPDATE SET version = EXCLUDED.version, body = EXCLUDED.body, updated_at = NOW()
+    """, [(key, hashlib.sha1(body.encode('utf-8')).hexdigest()[:16], body) for key, body in snapshots])
+    cursor.close()
+
+
+def rebuild_catalog(conn) -> dict:
+    rebuild_catalog_snapshot(conn)
+    conn.commit()
+    
+    return json_response(200, {'message': 'Снапшот каталога перестроен'})
+
+
+def get_stats(conn) -> dict:
+    """Статистика дашборда: итог из dashboard_stats плюс ещё не свёрнутые строки dashboard_stats_deltas,
+    которые пишут триггеры. Когда дельт больше DASHBOARD_FOLD_AFTER, они сворачиваются в итог.
+    Активные подписки считаются по частичному idx_orders_expires_at (subscription_status = 'active');
+    сравнение с NOW() отсекает подписки, истёкшие после последнего прохода sweeper'а."""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     cursor.execute("""
-        SELECT COUNT(*) as total FROM orders 
-        WHERE payment_confirmed = TRUE AND expires_at > NOW()
+        SELECT s.users_count + d.users_delta as users_count,
+               s.products_count + d.products_delta as products_count,
+               s.orders_count + d.orders_delta as orders_count,
+               s.revenue + d.revenue_delta as revenue,
+               d.pending as pending_deltas,
+               (SELECT COUNT(*) FROM orders
+                WHERE subscription_status = 'active' AND expires_at > NOW()) as active_subscriptions
+        FROM dashboard_stats s
+        CROSS JOIN (
+            SELECT COALESCE(SUM(users_delta), 0) as users_delta,
+                   COALESCE(SUM(products_delta), 0) as products_delta,
+                   COALESCE(SUM(orders_delta), 0) as orders_delta,
+                   COALESCE(SUM(revenue_delta), 0) as revenue_delta,
+                   COUNT(*) as pending
+            FROM dashboard_stats_deltas
+        ) d
+        WHERE s.id = 1
     """)
-    active_subscriptions = cursor.fetchone()['total']
+    stats = cursor.fetchone()
+    cursor.close()
+    
+    if not stats:
+        return recompute_stats(conn)
     
+    if stats['pending_deltas'] > DASHBOARD_FOLD_AFTER:
+        fold_stats_deltas(conn)
+    
+    return json_response(200, {
+        'users': int(stats['users_count']),
+        'products': int(stats['products_count']),
+        'orders': int(stats['orders_count']),
+        'revenue': float(stats['revenue']),
+        'active_subscriptions': int(stats['active_subscriptions'])
+    })
+
+
+def fold_stats_deltas(conn) -> None:
+    """Переносит накопленные дельты в строку dashboard_stats одним запросом. Удаляются ровно те дельты,
+    что видны запросу, поэтому параллельные незакоммиченные изменения не теряются и не учитываются дважды."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        WITH folded AS (
+            DELETE FROM dashboard_stats_deltas
+            RETURNING users_delta, products_delta, orders_delta, revenue_delta
+        )
+        UPDATE dashboard_stats s
+        SET users_count = s.users_count + f.users_delta,
+            products_count = s.products_count + f.products_delta,
+            orders_count = s.orders_count + f.orders_delta,
+            revenue = s.revenue + f.revenue_delta,
+            updated_at = NOW()
+        FROM (
+            SELECT COALESCE(SUM(users_delta), 0) as users_delta,
+                   COALESCE(SUM(products_delta), 0) as products_delta,
+                   COALESCE(SUM(orders_delta), 0) as orders_delta,
+                   COALESCE(SUM(revenue_delta), 0) as revenue_delta
+            FROM folded
+        ) f
+        WHERE s.id = 1
+    """)
+    conn.commit()
+    cursor.close()
+
+
+def recompute_stats(conn) -> dict:
+    """Пересчитывает dashboard_stats с нуля (один проход по каждой таблице), исправляя расхождения.
+    Дельты, видимые этому же запросу, уже учтены в пересчёте и удаляются вместе с ним."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        WITH cleared AS (
+            DELETE FROM dashboard_stats_deltas
+        )
+        INSERT INTO dashboard_stats (id, users_count, products_count, orders_count, revenue, updated_at)
+        SELECT 1,
+               (SELECT COUNT(*) FROM users),
+               (SELECT COUNT(*) FROM products WHERE is_active = TRUE),
+               COUNT(*),
+               COALESCE(SUM(total_amount) FILTER (WHERE status = 'paid' OR payment_confirmed = TRUE), 0),
+               NOW()
+        FROM orders
+        ON CONFLICT (id) DO UPDATE
+        SET users_count = EXCLUDED.users_count, products_count = EXCLUDED.products_count,
+            orders_count = EXCLUDED.orders_count, revenue = EXCLUDED.revenue, updated_at = NOW()
+    """)
+    conn.commit()
     cursor.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'users': int(users_count),
-            'products': int(products_count),
-            'orders': int(orders_count),
-            'revenue': float(revenue),
-            'active_subscriptions': int(active_subscriptions)
-        }),
-        'isBase64Encoded': False
+    return get_stats(conn)
+
+
+ANALYTICS_GRANULARITIES = ('day', 'week', 'month')
+ANALYTICS_GROUPS = {'': 'NULL', 'product_id': 'd.product_id', 'category': 'p.category'}
+
+# Заказы по дню создания и оплаты по дню подтверждения за [start, end) - в том же виде, что daily_order_stats
+ANALYTICS_DAILY_ORDERS = """
+    SELECT created_at::date as day, COALESCE(product_id, 0) as product_id,
+           1 as new_orders, 0 as confirmed_payments, 0 as revenue
+    FROM orders WHERE created_at >= %(start)s AND created_at < %(end)s
+    UNION ALL
+    SELECT paid_at::date, COALESCE(product_id, 0), 0, 1, total_amount
+    FROM orders WHERE payment_confirmed = TRUE AND paid_at >= %(start)s AND paid_at < %(end)s
+"""
+
+
+def roll_up_analytics(conn) -> date:
+    """Досчитывает дневные агрегаты за завершённые дни, которых ещё нет в rollup.
+    Возвращает rolled_up_to - первый день, который нужно считать на лету (обычно сегодня)."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT rolled_up_to, CURRENT_DATE FROM analytics_rollup_state WHERE id = 1")
+    rolled_up_to, today = cursor.fetchone()
+    if rolled_up_to >= today:
+        cursor.close()
+        return rolled_up_to
+    
+    cursor.execute("SELECT rolled_up_to FROM analytics_rollup_state WHERE id = 1 FOR UPDATE")
+    rolled_up_to = cursor.fetchone()[0]
+    if rolled_up_to < today:
+        bounds = {'start': rolled_up_to, 'end': today}
+        cursor.execute(f"""
+            INSERT INTO daily_order_stats (day, product_id, new_orders, confirmed_payments, revenue)
+            SELECT day, product_id, SUM(new_orders), SUM(confirmed_payments), SUM(revenue)
+            FROM ({ANALYTICS_DAILY_ORDERS}) d
+            GROUP BY day, product_id
+            ON CONFLICT (day, product_id) DO UPDATE
+            SET new_orders = EXCLUDED.new_orders,
+                confirmed_payments = EXCLUDED.confirmed_payments,
+                revenue = EXCLUDED.revenue
+        """, bounds)
+        cursor.execute("""
+            INSERT INTO daily_user_stats (day, new_users)
+            SELECT created_at::date, COUNT(*)
+            FROM users WHERE created_at >= %(start)s AND created_at < %(end)s
+            GROUP BY created_at::date
+            ON CONFLICT (day) DO UPDATE SET new_users = EXCLUDED.new_users
+        """, bounds)
+        cursor.execute("UPDATE analytics_rollup_state SET rolled_up_to = %(end)s WHERE id = 1", bounds)
+    
+    conn.commit()
+    cursor.close()
+    return today
+
+
+_query_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix='query')
+
+
+def fetch_all(conn, sql: str, params) -> list:
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def fetch_concurrently(conn, queries: list) -> list:
+    """Выполняет независимые запросы на чтение параллельно: первый - на conn, остальные - на свободных
+    соединениях пула. Задержка ограничена самым медленным запросом, а не суммой.
+    Если свободного соединения нет, запрос выполняется на conn после первого - пул не ждём."""
+    pool = get_pool()
+    borrowed = []
+    futures = []
+    try:
+        for sql, params in queries[1:]:
+            try:
+                extra = pool.getconn(timeout=0)
+            except PoolError:
+                futures.append(None)
+                continue
+            borrowed.append(extra)
+            futures.append(_query_executor.submit(fetch_all, extra, sql, params))
+        
+        results = [fetch_all(conn, *queries[0])]
+        for (sql, params), future in zip(queries[1:], futures):
+            results.append(future.result() if future else fetch_all(conn, sql, params))
+        return results
+    finally:
+        wait([f for f in futures if f])
+        for extra in borrowed:
+            pool.putconn(extra)
+
+
+def get_analytics(conn, params: dict) -> dict:
+    """Выручка, новые заказы, подтверждённые оплаты и новые пользователи по дням/неделям/месяцам.
+    Завершённые дни берутся из daily_*_stats, на лету считается только текущий день.
+    Параметры: granularity (day|week|month), group_by (product_id|category), date_from, date_to (не включительно)."""
+    granularity = params.get('granularity', 'day')
+    group_by = params.get('group_by', '')
+    if granularity not in ANALYTICS_GRANULARITIES or group_by not in ANALYTICS_GROUPS:
+        return bad_page_params_response()
+    
+    rolled_up_to = roll_up_analytics(conn)
+    try:
+        date_to = date.fromisoformat(params['date_to']) if params.get('date_to') else rolled_up_to + timedelta(days=1)
+        date_from = date.fromisoformat(params['date_from']) if params.get('date_from') else date_to - timedelta(days=30)
+    except ValueError:
+        return bad_page_params_response()
+    
+    bounds = {
+        'granularity': granularity,
+        'from': date_from,
+        'to': date_to,
+        'rolled': rolled_up_to,
+        'start': max(date_from, rolled_up_to),
+        'end': date_to
     }
+    
+    series_sql = f"""
+        SELECT date_trunc(%(granularity)s, d.day)::date as bucket,
+               {ANALYTICS_GROUPS[group_by]} as group_key,
+               SUM(d.new_orders)::int as new_orders,
+               SUM(d.confirmed_payments)::int as confirmed_payments,
+               SUM(d.revenue) as revenue
+        FROM (
+            SELECT day, product_id, new_orders, confirmed_payments, revenue
+            FROM daily_order_stats
+            WHERE day >= %(from)s AND day < %(to)s AND day < %(rolled)s
+            UNION ALL
+            {ANALYTICS_DAILY_ORDERS}
+        ) d
+        LEFT JOIN products p ON p.id = d.product_id
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """
+    users_sql = """
+        SELECT date_trunc(%(granularity)s, d.day)::date as bucket, SUM(d.new_users)::int as new_users
+        FROM (
+            SELECT day, new_users
+            FROM daily_user_stats
+            WHERE day >= %(from)s AND day < %(to)s AND day < %(rolled)s
+            UNION ALL
+            SELECT created_at::date, 1
+            FROM users WHERE created_at >= %(start)s AND created_at < %(end)s
+        ) d
+        GROUP BY 1
+        ORDER BY 1
+    """
+    
+    # Ряды заказов и пользователей независимы - читаются параллельно на двух соединениях
+    series, users = fetch_concurrently(conn, [(series_sql, bounds), (users_sql, bounds)])
+    series = [dict(row, revenue=float(row['revenue'])) for row in series]
+    
+    return json_response(200, {
+        'granularity': granularity,
+        'group_by': group_by or None,
+        'date_from': date_from,
+        'date_to': date_to,
+        'series': series,
+        'users': [dict(u) for u in users]
+    })
+
+
+def order_filters(params: dict):
+    """Условия WHERE по фильтрам заказов: status, payment_confirmed, product_id,
+    date_from (включительно) и date_to (не включительно) по created_at,
+    search - номер заказа или подстрока email, имени клиента, названия продукта. ValueError при ошибке."""
+    conditions, args = [], []
+    if params.get('search'):
+        pattern = like_pattern(params['search'])
+        conditions.append('(o.id::text = %s OR u.email ILIKE %s OR u.full_name ILIKE %s OR p.title ILIKE %s)')
+        args.extend([params['search'].strip(), pattern, pattern, pattern])
+    if params.get('status'):
+        conditions.append('o.status = %s')
+        args.append(params['status'])
+    if params.get('payment_confirmed'):
+        if params['payment_confirmed'] not in ('true', 'false'):
+            raise ValueError('payment_confirmed')
+        conditions.append('o.payment_confirmed = %s')
+        args.append(params['payment_confirmed'] == 'true')
+    if params.get('product_id'):
+        conditions.append('o.product_id = %s')
+        args.append(int(params['product_id']))
+    if params.get('date_from'):
+        conditions.append('o.created_at >= %s')
+        args.append(datetime.fromisoformat(params['date_from']))
+    if params.get('date_to'):
+        conditions.append('o.created_at < %s')
+        args.append(datetime.fromisoformat(params['date_to']))
+    return conditions, args
 
 
-def get_orders(conn) -> dict:
+def get_orders(conn, params: dict) -> dict:
+    """Заказы постранично (keyset по created_at, id) с фильтрами из order_filters"""
+    try:
+        limit, after = parse_page_params(params)
+        conditions, args = order_filters(params)
+    except ValueError:
+        return bad_page_params_response()
+    
+    if after:
+        conditions.append("(COALESCE(o.created_at, TIMESTAMP 'epoch'), o.id) < (%s, %s)")
+        args.extend(after)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT o.id, o.user_id, o.product_id, o.total_amount, o.status,
                o.paid_at, o.expires_at, o.access_token, o.payment_confirmed,
                o.payment_method, o.payment_reference, o.notes, o.created_at,
@@ -326,99 +1203,550 @@ def get_orders(conn) -> dict:
         FROM orders o
         LEFT JOIN users u ON o.user_id = u.id
         LEFT JOIN products p ON o.product_id = p.id
-        ORDER BY o.created_at DESC
-    """)
-    orders = cursor.fetchall()
+        {where}
+        ORDER BY COALESCE(o.created_at, TIMESTAMP 'epoch') DESC, o.id DESC
+        LIMIT %s
+    """, (*args, limit + 1))
+    orders, next_cursor = paginate(cursor.fetchall(), limit)
+    cursor.close()
+    
+    return json_response(200, {'orders': [dict(o) for o in orders], 'next_cursor': next_cursor})
+
+
+EXPORT_QUERIES = {
+    'orders': ("""
+        SELECT o.id, o.user_id, o.product_id, o.total_amount, o.status,
+               o.paid_at, o.expires_at, o.access_token, o.payment_confirmed,
+               o.payment_method, o.payment_reference, o.notes, o.created_at,
+               u.email as user_email, u.full_name as user_name,
+               p.title as product_title, p.website_url
+        FROM orders o
+        LEFT JOIN users u ON o.user_id = u.id
+        LEFT JOIN products p ON o.product_id = p.id
+        {where}
+        ORDER BY o.created_at, o.id
+    """, order_filters),
+    'users': ("""
+        SELECT u.id, u.email, u.full_name, u.phone, u.role, u.created_at,
+               w.balance
+        FROM users u
+        LEFT JOIN wallets w ON u.id = w.user_id
+        {where}
+        ORDER BY u.created_at, u.id
+    """, user_filters),
+}
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_ENTITIES = ('catalog', *EXPORT_QUERIES)
+
+
+def write_export(conn, entity: str, fmt: str, params: dict, out) -> int:
+    """Пишет выгрузку entity в out (бинарный поток) в виде gzip CSV/NDJSON.
+    Строки читаются серверным курсором пачками по EXPORT_BATCH_SIZE, поэтому память не растёт
+    с размером таблицы. Возвращает число выгруженных строк; ValueError при неверных фильтрах."""
+    query, filters = EXPORT_QUERIES[entity]
+    conditions, args = filters(params)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    
+    cursor = conn.cursor(name=f'export_{entity}', cursor_factory=RealDictCursor)
+    cursor.itersize = EXPORT_BATCH_SIZE
+    cursor.execute(query.format(where=where), args)
+    
+    total = 0
+    with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        writer = None
+        if fmt == 'csv':
+            writer = csv.writer(text)
+            writer.writerow([column.name for column in cursor.description])
+        while rows:
+            if writer:
+                writer.writerows([row.values() for row in rows])
+            else:
+                text.write(''.join(dumps(row) + '\n' for row in rows))
+            total += len(rows)
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        text.flush()
+        text.detach()
+    
     cursor.close()
+    conn.rollback()
+    return total
+
+
+class ExportTooLarge(Exception):
+    pass
+
+
+class CappedBuffer(io.BytesIO):
+    """BytesIO, который прерывает выгрузку, как только она превышает limit байт"""
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+
+    def write(self, data) -> int:
+        if self.tell() + len(data) > self.limit:
+            raise ExportTooLarge()
+        return super().write(data)
+
+
+def export_period(params: dict) -> str:
+    """Период для имени файла: только значения date_from/date_to, которые разбираются как даты"""
+    dates = []
+    for key in ('date_from', 'date_to'):
+        try:
+            dates.append(datetime.fromisoformat(params[key]).date().isoformat())
+        except (KeyError, TypeError, ValueError):
+            continue
+    return '_'.join(dates)
+
+
+def export_data(conn, params: dict) -> dict:
+    """Выгрузка заказов, пользователей или каталога одним gzip-файлом (base64 в теле ответа).
+    Ответ собирается в памяти, поэтому сжатый файл ограничен EXPORT_HTTP_MAX_BYTES (по умолчанию 4 МБ);
+    больше - 413 с просьбой сузить период или выгрузить через CLI, который пишет поток в файл."""
+    entity = params.get('entity', 'orders')
+    fmt = params.get('format', 'csv')
+    
+    if entity not in EXPORT_ENTITIES or fmt not in EXPORT_FORMATS:
+        return json_response(400, {'error': 'Неизвестный тип или формат выгрузки'})
+    
+    buffer = CappedBuffer(EXPORT_HTTP_MAX_BYTES)
+    try:
+        if entity == 'catalog':
+            total = write_catalog(conn, fmt, buffer)
+        else:
+            total = write_export(conn, entity, fmt, params, buffer)
+    except ValueError:
+        conn.rollback()
+        return bad_page_params_response()
+    except ExportTooLarge:
+        # Прерванный COPY может оставить соединение в неопределённом состоянии - тогда пул его закроет
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+        return json_response(413, {
+            'error': f'Выгрузка больше {EXPORT_HTTP_MAX_BYTES / (1024 * 1024):g} МБ. Выгрузите по частям '
+                     f'с меньшим периодом date_from/date_to или через CLI: python backend/admin/index.py export {entity}'
+        })
+    
+    period = export_period(params)
+    filename = f"{entity}{'_' + period if period else ''}.{fmt}.gz"
     
     return {
         'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'orders': [dict(o) for o in orders]}, default=str),
-        'isBase64Encoded': False
+        'headers': {
+            'Content-Type': 'application/gzip',
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Export-Format': EXPORT_FORMATS[fmt],
+            'X-Export-Rows': str(total),
+            'Access-Control-Expose-Headers': 'Content-Disposition, X-Export-Format, X-Export-Rows',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': base64.b64encode(buffer.getvalue()).decode('ascii'),
+        'isBase64Encoded': True
     }
 
 
-def update_order(conn, body: dict) -> dict:
-    order_id = body.get('id')
-    status = body.get('status')
-    notes = body.get('notes', '')
+# Колонки выгрузки и загрузки каталога - выгруженный файл загружается обратно без правок
+CATALOG_COLUMNS = ('id', 'title', 'description', 'price', 'category', 'image_url', 'demo_url',
+                   'website_url', 'subscription_days', 'upgrades', 'is_subscription', 'is_active')
+# CSV с управляющими символами вместо кавычки и разделителя: строка NDJSON идёт через COPY
+# одним полем без экранирования (в JSON такие символы бывают только как \u0001)
+NDJSON_COPY_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+CATALOG_IMPORT_MAX_ERRORS = 100
+BOOLEAN_VALUES = "('true', 'false', 't', 'f', '1', '0', 'yes', 'no')"
+
+
+def write_catalog(conn, fmt: str, out) -> int:
+    """Выгружает каталог через COPY ... TO STDOUT прямо в gzip-поток out, без разбора строк в Python"""
+    query = f"SELECT {', '.join(CATALOG_COLUMNS)} FROM products ORDER BY id"
+    if fmt == 'csv':
+        copy = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+    else:
+        copy = f"COPY (SELECT row_to_json(c) FROM ({query}) c) TO STDOUT WITH ({NDJSON_COPY_OPTIONS})"
     
     cursor = conn.cursor()
+    with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+        cursor.copy_expert(copy, gz)
+    total = cursor.rowcount
+    cursor.close()
+    conn.rollback()
+    return total
+
+
+def import_catalog(conn, fmt: str, stream):
+    """Загружает каталог из CSV (с заголовком) или NDJSON: COPY во временную таблицу,
+    проверка всех строк одним запросом и upsert в products одним запросом.
+    Строки с id обновляют существующие продукты (пустые поля не меняются), без id - создаются.
+    Возвращает (результат, ошибки); при ошибках ничего не записывается."""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TEMP TABLE catalog_import (
+            row_no BIGSERIAL,
+            {', '.join(f'{column} TEXT' for column in CATALOG_COLUMNS)}
+        ) ON COMMIT DROP
+    """)
+    
+    if fmt == 'csv':
+        header = next(csv.reader([stream.readline()]), [])
+        unknown = [column for column in header if column not in CATALOG_COLUMNS]
+        if not header or unknown:
+            conn.rollback()
+            cursor.close()
+            return None, [{'row': 0, 'error': f"Неизвестные колонки: {', '.join(unknown) or 'нет заголовка'}"}]
+        cursor.copy_expert(f"COPY catalog_import ({', '.join(header)}) FROM STDIN WITH (FORMAT csv)", stream)
+    else:
+        cursor.execute("CREATE TEMP TABLE catalog_import_raw (row_no BIGSERIAL, doc TEXT) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY catalog_import_raw (doc) FROM STDIN WITH ({NDJSON_COPY_OPTIONS})", stream)
+        cursor.execute("DELETE FROM catalog_import_raw WHERE doc IS NULL OR btrim(doc) = ''")
+        cursor.execute(f"""
+            INSERT INTO catalog_import (row_no, {', '.join(CATALOG_COLUMNS)})
+            SELECT r.row_no, d.*
+            FROM catalog_import_raw r,
+                 jsonb_to_record(try_jsonb(r.doc)) AS d({', '.join(f'{column} TEXT' for column in CATALOG_COLUMNS)})
+            WHERE jsonb_typeof(try_jsonb(r.doc)) = 'object'
+        """)
+        cursor.execute(f"""
+            SELECT row_no, 'Строка не является JSON-объектом' FROM catalog_import_raw
+            WHERE jsonb_typeof(try_jsonb(doc)) IS DISTINCT FROM 'object'
+            ORDER BY row_no LIMIT {CATALOG_IMPORT_MAX_ERRORS}
+        """)
+        errors = [{'row': row_no, 'error': error} for row_no, error in cursor.fetchall()]
+        if errors:
+            conn.rollback()
+            cursor.close()
+            return None, errors
+    
+    cursor.execute(rf"""
+        SELECT row_no, error FROM (
+            SELECT row_no, CASE
+                WHEN id IS NOT NULL AND id !~ '^\d{{1,10}}$' THEN 'id: ожидается целое число'
+                WHEN id IS NOT NULL AND COUNT(*) OVER (PARTITION BY id) > 1 THEN 'id: продукт повторяется'
+                WHEN id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM products p WHERE p.id = i.id::bigint)
+                    THEN 'id: продукт не найден'
+                WHEN id IS NULL AND (NULLIF(btrim(title), '') IS NULL OR price IS NULL)
+                    THEN 'title и price обязательны для нового продукта'
+                WHEN price IS NOT NULL AND price !~ '^\d{{1,8}}(\.\d{{1,2}})?$' THEN 'price: ожидается число'
+                WHEN subscription_days IS NOT NULL AND subscription_days !~ '^\d{{1,5}}$'
+                    THEN 'subscription_days: ожидается целое число'
+                WHEN upgrades IS NOT NULL AND jsonb_typeof(try_jsonb(upgrades)) IS DISTINCT FROM 'array'
+                    THEN 'upgrades: ожидается JSON-массив'
+                WHEN upgrades IS NOT NULL AND EXISTS (
+                    SELECT 1 FROM jsonb_array_elements(try_jsonb(upgrades)) u WHERE jsonb_typeof(u) <> 'object'
+                ) THEN 'upgrades: элементы должны быть объектами'
+                WHEN lower(is_subscription) NOT IN {BOOLEAN_VALUES} THEN 'is_subscription: ожидается true/false'
+                WHEN lower(is_active) NOT IN {BOOLEAN_VALUES} THEN 'is_active: ожидается true/false'
+            END as error
+            FROM catalog_import i
+        ) checked
+        WHERE error IS NOT NULL
+        ORDER BY row_no
+        LIMIT {CATALOG_IMPORT_MAX_ERRORS}
+    """)
+    errors = [{'row': row_no, 'error': error} for row_no, error in cursor.fetchall()]
+    if errors:
+        conn.rollback()
+        cursor.close()
+        return None, errors
+    
     cursor.execute("""
-        UPDATE orders SET status = %s, notes = %s, updated_at = NOW()
-        WHERE id = %s
-    """, (status, notes, order_id))
+        WITH valid AS (
+            SELECT row_no, id::int as id, title, description, price::numeric as price, category,
+                   image_url, demo_url, website_url, subscription_days::int as subscription_days,
+                   upgrades::jsonb as upgrades, is_subscription::boolean as is_subscription,
+                   is_active::boolean as is_active
+            FROM catalog_import
+        ), updated AS (
+            UPDATE products p
+            SET title = COALESCE(v.title, p.title),
+                description = COALESCE(v.description, p.description),
+                price = COALESCE(v.price, p.price),
+                category = COALESCE(v.category, p.category),
+                image_url = COALESCE(v.image_url, p.image_url),
+                demo_url = COALESCE(v.demo_url, p.demo_url),
+                website_url = COALESCE(v.website_url, p.website_url),
+                subscription_days = COALESCE(v.subscription_days, p.subscription_days),
+                upgrades = COALESCE(v.upgrades, p.upgrades),
+                is_subscription = COALESCE(v.is_subscription, p.is_subscription),
+                is_active = COALESCE(v.is_active, p.is_active),
+                updated_at = NOW()
+            FROM valid v
+            WHERE v.id IS NOT NULL AND p.id = v.id
+            RETURNING p.id
+        ), inserted AS (
+            INSERT INTO products (title, description, price, category, image_url, demo_url, website_url,
+                                  subscription_days, upgrades, is_subscription, is_active)
+            SELECT title, description, price, category, image_url, COALESCE(demo_url, ''),
+                   COALESCE(website_url, ''), COALESCE(subscription_days, 30), COALESCE(upgrades, '[]'),
+                   COALESCE(is_subscription, TRUE), COALESCE(is_active, TRUE)
+            FROM valid
+            WHERE id IS NULL
+            ORDER BY row_no
+            RETURNING id
+        )
+        SELECT (SELECT COUNT(*) FROM inserted), (SELECT COUNT(*) FROM updated)
+    """)
+    inserted, updated = cursor.fetchone()
+    cursor.close()
     
+    rebuild_catalog_snapshot(conn)
+    conn.commit()
+    return {'inserted': inserted, 'updated': updated}, []
+
+
+def import_catalog_request(conn, event: dict, params: dict) -> dict:
+    """Загрузка каталога: тело - CSV или NDJSON (format), можно в base64 и gzip"""
+    fmt = params.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return json_response(400, {'error': 'Неизвестный формат загрузки'})
+    
+    data = event.get('body') or ''
+    data = base64.b64decode(data) if event.get('isBase64Encoded') else data.encode('utf-8')
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    
+    result, errors = import_catalog(conn, fmt, io.StringIO(data.decode('utf-8-sig')))
+    if errors:
+        return json_response(400, {'error': 'Каталог не загружен: ошибки в строках', 'errors': errors})
+    
+    return json_response(200, result)
+
+
+def sign_access_token(claims: dict) -> str:
+    """Токен доступа вида v1.<payload>.<hmac-sha256>: сайт продукта проверяет его без обращения к БД"""
+    payload = base64.urlsafe_b64encode(
+        json.dumps(claims, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    ).rstrip(b'=').decode('ascii')
+    signature = hmac.new(ACCESS_TOKEN_SECRET.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+    return f"v1.{payload}.{base64.urlsafe_b64encode(signature).rstrip(b'=').decode('ascii')}"
+
+
+# Сообщает функции orders, что кэш результатов check_access устарел. Завершает CTE записи заказа,
+# чтобы изменение заказа, список отзыва и поколение кэша обновлялись за один запрос.
+BUMP_ACCESS_GENERATION = "UPDATE cache_generations SET generation = generation + 1 WHERE name = 'access'"
+
+
+ORDER_STATUSES = ('pending', 'paid', 'completed', 'cancelled')
+
+
+def update_orders(cursor, items: list) -> list:
+    """Обновляет статус и заметки пачки заказов одним запросом. Возвращает id найденных заказов.
+    Подписанные токены проверяются без БД, поэтому отменённые заказы попадают в список отзыва,
+    а остальные из него удаляются."""
+    unique = {item['id']: item for item in items}
+    rows = execute_values(cursor, f"""
+        WITH v (id, status, notes) AS (VALUES %s),
+        updated AS (
+            UPDATE orders o SET status = v.status, notes = v.notes, updated_at = NOW()
+            FROM v WHERE o.id = v.id
+            RETURNING o.id, o.status
+        ), revoked AS (
+            INSERT INTO revoked_access_tokens (order_id, revoked_at)
+            SELECT id, LOCALTIMESTAMP FROM updated WHERE status = 'cancelled'
+            ON CONFLICT (order_id) DO UPDATE SET revoked_at = EXCLUDED.revoked_at
+        ), restored AS (
+            DELETE FROM revoked_access_tokens
+            WHERE order_id IN (SELECT id FROM updated WHERE status IS DISTINCT FROM 'cancelled')
+        ), bumped AS (
+            {BUMP_ACCESS_GENERATION}
+        )
+        SELECT id FROM updated
+    """, [(item['id'], item['status'], item.get('notes', '')) for item in unique.values()],
+        template='(%s::int, %s::varchar, %s::text)', page_size=len(unique), fetch=True)
+    return [row[0] for row in rows]
+
+
+def confirm_payments(cursor, items: list) -> dict:
+    """Подтверждает оплату пачки заказов в текущей транзакции: два запроса на любую пачку.
+    paid_at и expires_at (по subscription_days продукта) считает БД - LOCALTIMESTAMP постоянен
+    в транзакции, поэтому даты в подписанных токенах совпадают с записанными в заказ.
+    Повторное подтверждение сохраняет прежний paid_at: roll_up_analytics считает выручку
+    по дню paid_at, и заказ не должен попасть в итоги второй раз.
+    Повторное подтверждение отзывает ранее выданные токены заказа: revoked_at = LOCALTIMESTAMP,
+    а старые токены выданы строго раньше нового (issued_at < revoked_at - отозван).
+    Возвращает {order_id: (access_token, expires_at)} для найденных заказов."""
+    cursor.execute("""
+        SELECT o.id, o.user_id, o.payment_confirmed as was_confirmed, p.title as product_title,
+               u.email as user_email, u.full_name as user_name,
+               LOCALTIMESTAMP as issued_at,
+               LOCALTIMESTAMP + make_interval(days => COALESCE(p.subscription_days, 30)) as expires_at
+        FROM orders o
+        JOIN products p ON o.product_id = p.id
+        LEFT JOIN users u ON o.user_id = u.id
+        WHERE o.id = ANY(%s::int[])
+        FOR UPDATE OF o
+    """, ([item['order_id'] for item in items],))
+    orders = {row['id']: row for row in cursor.fetchall()}
+    if not orders:
+        return {}
+    
+    tokens = {}
+    for order_id, order in orders.items():
+        if ACCESS_TOKEN_SECRET:
+            tokens[order_id] = sign_access_token({
+                'order_id': order_id,
+                'user_id': order['user_id'],
+                'user_email': order['user_email'],
+                'user_name': order['user_name'],
+                'product_title': order['product_title'],
+                'issued_at': str(order['issued_at']),
+                'expires_at': str(order['expires_at'])
+            })
+        else:
+            tokens[order_id] = secrets.token_urlsafe(32)
+    
+    values = {item['order_id']: item for item in items if item['order_id'] in orders}
+    if not values:
+        return {}
+    execute_values(cursor, f"""
+        WITH v (id, was_confirmed, access_token, payment_reference, notes) AS (VALUES %s),
+        confirmed AS (
+            UPDATE orders o
+            SET status = 'paid', payment_confirmed = TRUE, paid_at = COALESCE(o.paid_at, LOCALTIMESTAMP),
+                expires_at = LOCALTIMESTAMP + make_interval(days => COALESCE(p.subscription_days, 30)),
+                access_token = v.access_token, payment_reference = v.payment_reference,
+                notes = v.notes, updated_at = NOW()
+            FROM v, products p
+            WHERE o.id = v.id AND p.id = o.product_id
+            RETURNING o.id, v.was_confirmed
+        ), revoked AS (
+            INSERT INTO revoked_access_tokens (order_id, revoked_at)
+            SELECT id, LOCALTIMESTAMP FROM confirmed WHERE was_confirmed
+            ON CONFLICT (order_id) DO UPDATE SET revoked_at = EXCLUDED.revoked_at
+        ), restored AS (
+            DELETE FROM revoked_access_tokens
+            WHERE order_id IN (SELECT id FROM confirmed WHERE NOT was_confirmed)
+        )
+        {BUMP_ACCESS_GENERATION}
+    """, [(order_id, bool(orders[order_id]['was_confirmed']), tokens[order_id],
+           item.get('payment_reference', ''), item.get('notes', ''))
+          for order_id, item in values.items()],
+        template='(%s::int, %s::boolean, %s::text, %s::text, %s::text)', page_size=len(values))
+    
+    return {order_id: (tokens[order_id], orders[order_id]['expires_at']) for order_id in values}
+
+
+def parse_bulk_items(body: dict, key: str):
+    """Список объектов из body['orders'] с целым key в каждом; None, если формат неверный"""
+    items = body.get('orders')
+    if not isinstance(items, list) or not items or len(items) > ADMIN_BULK_MAX:
+        return None
+    try:
+        return [dict(item, **{key: int(item[key])}) for item in items]
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def bad_bulk_response() -> dict:
+    return json_response(400, {'error': f'Ожидается непустой список orders (не больше {ADMIN_BULK_MAX})'})
+
+
+def update_order(conn, body: dict) -> dict:
+    cursor = conn.cursor()
+    update_orders(cursor, [{'id': body.get('id'), 'status': body.get('status'), 'notes': body.get('notes', '')}])
     conn.commit()
     cursor.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Заказ обновлен'}),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'message': 'Заказ обновлен'})
+
+
+def bulk_update_orders(conn, body: dict) -> dict:
+    """Пакетное изменение заказов: {"orders": [{"id", "status", "notes"}, ...]} в одной транзакции"""
+    items = parse_bulk_items(body, 'id')
+    if items is None:
+        return bad_bulk_response()
+    
+    valid = [item for item in items if item.get('status') in ORDER_STATUSES]
+    updated = set()
+    if valid:
+        cursor = conn.cursor()
+        updated = set(update_orders(cursor, valid))
+        conn.commit()
+        cursor.close()
+    
+    results = []
+    for item in items:
+        if item.get('status') not in ORDER_STATUSES:
+            results.append({'id': item['id'], 'status': 'invalid', 'error': 'Неизвестный статус заказа'})
+        elif item['id'] in updated:
+            results.append({'id': item['id'], 'status': 'updated'})
+        else:
+            results.append({'id': item['id'], 'status': 'not_found', 'error': 'Заказ не найден'})
+    
+    return json_response(200, {'updated': len(updated), 'results': results})
 
 
 def admin_confirm_payment(conn, body: dict) -> dict:
     """Администратор подтверждает оплату вручную - генерируется access_token и ссылка"""
-    order_id = body.get('order_id')
-    payment_reference = body.get('payment_reference', '')
-    notes = body.get('notes', '')
+    try:
+        order_id = int(body.get('order_id'))
+    except (TypeError, ValueError):
+        return json_response(404, {'error': 'Заказ не найден'})
     
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
-        SELECT o.*, p.subscription_days, p.website_url
-        FROM orders o
-        JOIN products p ON o.product_id = p.id
-        WHERE o.id = %s
-    """, (order_id,))
-    order = cursor.fetchone()
+    confirmed = confirm_payments(cursor, [{
+        'order_id': order_id,
+        'payment_reference': body.get('payment_reference', ''),
+        'notes': body.get('notes', '')
+    }])
     
-    if not order:
+    if not confirmed:
+        conn.rollback()
         cursor.close()
-        conn.close()
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Заказ не найден'}),
-            'isBase64Encoded': False
-        }
+        return json_response(404, {'error': 'Заказ не найден'})
     
-    access_token = secrets.token_urlsafe(32)
-    sub_days = order['subscription_days'] or 30
+    conn.commit()
+    cursor.close()
+    access_token, _ = next(iter(confirmed.values()))
     
-    cursor.execute("""
-        UPDATE orders 
-        SET status = 'paid', payment_confirmed = TRUE, paid_at = NOW(),
-            expires_at = NOW() + INTERVAL '%s days',
-            access_token = %s, payment_reference = %s, notes = %s,
-            updated_at = NOW()
-        WHERE id = %s
-    """ % (sub_days, '%s', '%s', '%s', '%s'), (access_token, payment_reference, notes, order_id))
+    return json_response(200, {
+        'message': 'Оплата подтверждена',
+        'access_token': access_token
+    })
+
+
+def bulk_confirm_payments(conn, body: dict) -> dict:
+    """Пакетное подтверждение оплат по выписке банка:
+    {"orders": [{"order_id", "payment_reference", "notes"}, ...]} в одной транзакции"""
+    items = parse_bulk_items(body, 'order_id')
+    if items is None:
+        return bad_bulk_response()
     
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    confirmed = confirm_payments(cursor, items)
     conn.commit()
     cursor.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'message': 'Оплата подтверждена',
-            'access_token': access_token
-        }),
-        'isBase64Encoded': False
-    }
+    results = []
+    for item in items:
+        if item['order_id'] in confirmed:
+            access_token, expires_at = confirmed[item['order_id']]
+            results.append({
+                'order_id': item['order_id'],
+                'status': 'confirmed',
+                'access_token': access_token,
+                'expires_at': expires_at
+            })
+        else:
+            results.append({'order_id': item['order_id'], 'status': 'not_found', 'error': 'Заказ не найден'})
+    
+    return json_response(200, {'confirmed': len(confirmed), 'results': results})
 
 
 def update_user(conn, body: dict) -> dict:
     user_id = body.get('id')
     cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE users 
-        SET full_name = %s, phone = %s, role = %s, updated_at = NOW()
-        WHERE id = %s
+    cursor.execute(f"""
+        WITH updated AS (
+            UPDATE users 
+            SET full_name = %s, phone = %s, role = %s, updated_at = NOW()
+            WHERE id = %s
+        )
+        {BUMP_SESSION_GENERATION}
     """, (
         body.get('full_name'),
         body.get('phone'),
@@ -428,33 +1756,351 @@ def update_user(conn, body: dict) -> dict:
     
     conn.commit()
     cursor.close()
+    _session_cache.invalidate_user(int(user_id))
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Пользователь обновлен'}),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'message': 'Пользователь обновлен'})
 
 
 def reset_user_password(conn, body: dict) -> dict:
     user_id = body.get('user_id')
     new_password = body.get('new_password')
     
-    password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    password_hash = hash_password(new_password)
     
     cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE users SET password_hash = %s, updated_at = NOW()
-        WHERE id = %s
+    cursor.execute(f"""
+        WITH updated AS (
+            UPDATE users SET password_hash = %s, updated_at = NOW()
+            WHERE id = %s
+        )
+        {BUMP_SESSION_GENERATION}
     """, (password_hash, user_id))
     
     conn.commit()
     cursor.close()
+    _session_cache.invalidate_user(int(user_id))
     
+    return json_response(200, {'message': 'Пароль сброшен'})
+
+
+USER_ROLES = ('user', 'admin')
+
+
+def available_cpus() -> int:
+    """Ядра, доступные процессу (с учётом affinity/cgroup cpuset), а не все ядра машины"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def hash_passwords(passwords: list):
+    """bcrypt для списка паролей в пуле процессов по числу ядер: в потоках функции хеширование
+    упирается в BCRYPT_WORKERS, а при импорте сотен пользователей это основная стоимость.
+    Соли генерируются здесь, в процессы уходит только bcrypt.hashpw. Если процессы недоступны
+    (нет /dev/shm, один процессор) - хешируем в текущем процессе. Возвращает (хеши, процессов)."""
+    encoded = [password.encode('utf-8') for password in passwords]
+    salts = [bcrypt.gensalt(rounds=BCRYPT_ROUNDS) for _ in passwords]
+    processes = min(USER_IMPORT_PROCESSES or available_cpus(), len(passwords))
+    with timed('bcrypt'):
+        if processes > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    chunksize = max(1, len(passwords) // (processes * 4))
+                    hashes = list(pool.map(bcrypt.hashpw, encoded, salts, chunksize=chunksize))
+                return [value.decode('utf-8') for value in hashes], processes
+            except (OSError, NotImplementedError, BrokenProcessPool):
+                pass
+        return [bcrypt.hashpw(password, salt).decode('utf-8') for password, salt in zip(encoded, salts)], 1
+
+
+def normalize_user_row(row) -> tuple:
+    """Приводит строку импорта к (email, password, full_name, phone, role); ошибку - ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError('Ожидается объект')
+    email = str(row.get('email') or '').strip().lower()
+    password = str(row.get('password') or '')
+    if not email or not password:
+        raise ValueError('Email и пароль обязательны')
+    if len(password) < 6:
+        raise ValueError('Пароль должен быть минимум 6 символов')
+    role = str(row.get('role') or 'user').strip()
+    if role not in USER_ROLES:
+        raise ValueError(f'Неизвестная роль: {role}')
+    return email, password, str(row.get('full_name') or '').strip(), str(row.get('phone') or '').strip(), role
+
+
+def import_users(conn, rows: list, batch: int = USER_IMPORT_BATCH) -> dict:
+    """Массовое создание пользователей с кошельками, без сессий. Строка с ошибкой (неверные поля,
+    повтор email в файле или в базе) попадает в failed и не мешает остальным. Занятые email
+    отсеиваются до bcrypt; гонку с параллельной регистрацией закрывает ON CONFLICT. Вставка пачками
+    по batch строк через execute_values, каждая пачка - своя транзакция."""
+    started = time.perf_counter()
+    failed = []
+    pending = {}
+    for row_no, row in enumerate(rows, start=1):
+        try:
+            email, password, full_name, phone, role = normalize_user_row(row)
+        except ValueError as e:
+            failed.append({'row': row_no, 'email': row.get('email') if isinstance(row, dict) else None, 'error': str(e)})
+            continue
+        if email in pending:
+            failed.append({'row': row_no, 'email': email, 'error': 'Email повторяется в файле'})
+            continue
+        pending[email] = (row_no, password, full_name, phone, role)
+    
+    cursor = conn.cursor()
+    if pending:
+        cursor.execute("SELECT email FROM users WHERE email = ANY(%s)", (list(pending),))
+        for (email,) in cursor.fetchall():
+            failed.append({'row': pending.pop(email)[0], 'email': email, 'error': 'Пользователь с таким email уже существует'})
+        # Не держим транзакцию открытой, пока идёт хеширование
+        conn.rollback()
+    
+    emails = list(pending)
+    hashing_started = time.perf_counter()
+    hashes, processes = hash_passwords([pending[email][1] for email in emails]) if emails else ([], 0)
+    hash_seconds = time.perf_counter() - hashing_started
+    
+    created = []
+    inserting_started = time.perf_counter()
+    for offset in range(0, len(emails), batch):
+        values = [
+            (email, password_hash, pending[email][2], pending[email][3], pending[email][4])
+            for email, password_hash in zip(emails[offset:offset + batch], hashes[offset:offset + batch])
+        ]
+        inserted = execute_values(cursor, """
+            WITH v (email, password_hash, full_name, phone, role) AS (VALUES %s),
+            new_user AS (
+                INSERT INTO users (email, password_hash, full_name, phone, role)
+                SELECT email, password_hash, full_name, phone, role FROM v
+                ON CONFLICT (email) DO NOTHING
+                RETURNING id, email
+            ), wallet AS (
+                INSERT INTO wallets (user_id, balance, currency)
+                SELECT id, 0.00, 'RUB' FROM new_user
+            )
+            SELECT id, email FROM new_user
+        """, values, page_size=len(values), fetch=True)
+        conn.commit()
+        ids = {email: user_id for user_id, email in inserted}
+        for email, *_ in values:
+            if email in ids:
+                created.append({'row': pending[email][0], 'email': email, 'id': ids[email]})
+            else:
+                failed.append({'row': pending[email][0], 'email': email, 'error': 'Пользователь с таким email уже существует'})
+    insert_seconds = time.perf_counter() - inserting_started
+    cursor.close()
+    
+    total_seconds = time.perf_counter() - started
     return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Пароль сброшен'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+        'created': sorted(created, key=lambda item: item['row']),
+        'failed': sorted(failed, key=lambda item: item['row']),
+        'stats': {
+            'rows': len(rows),
+            'created': len(created),
+            'failed': len(failed),
+            'processes': processes,
+            'hash_seconds': round(hash_seconds, 3),
+            'insert_seconds': round(insert_seconds, 3),
+            'total_seconds': round(total_seconds, 3),
+            'hashes_per_second': round(len(hashes) / hash_seconds, 1) if hashes else 0.0,
+            'users_per_second': round(len(created) / total_seconds, 1) if total_seconds else 0.0
+        }
+    }
+
+
+def import_users_request(conn, body: dict) -> dict:
+    """Импорт пользователей: {"users": [{"email", "password", "full_name", "phone", "role"}, ...]}"""
+    rows = body.get('users')
+    if not isinstance(rows, list) or not rows or len(rows) > USER_IMPORT_MAX:
+        return json_response(400, {'error': f'Ожидается непустой список users (не больше {USER_IMPORT_MAX})'})
+    
+    result = import_users(conn, rows)
+    
+    return json_response(200, result)
+
+
+def purge_expired_sessions(conn, chunk: int, max_chunks: int) -> dict:
+    """Удаляет истёкшие сессии пачками по chunk строк, каждая пачка - отдельная короткая транзакция.
+    max_chunks ограничивает работу за один вызов (0 - до конца). Заодно чистит давно неактивные rate_limits
+    и сворачивает накопившиеся дельты статистики дашборда."""
+    cursor = conn.cursor()
+    deleted = 0
+    chunks = 0
+    finished = False
+    while not max_chunks or chunks < max_chunks:
+        cursor.execute("""
+            DELETE FROM sessions WHERE id IN (
+                SELECT id FROM sessions
+                WHERE expires_at <= NOW()
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (chunk,))
+        conn.commit()
+        deleted += cursor.rowcount
+        chunks += 1
+        if cursor.rowcount < chunk:
+            finished = True
+            break
+    
+    cursor.execute("DELETE FROM rate_limits WHERE updated_at < NOW() - INTERVAL '1 day'")
+    rate_limits_deleted = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    fold_stats_deltas(conn)
+    
+    return {
+        'sessions_deleted': deleted,
+        'rate_limits_deleted': rate_limits_deleted,
+        'finished': finished
+    }
+
+
+def purge_sessions(conn) -> dict:
+    result = purge_expired_sessions(conn, SESSION_PURGE_CHUNK, SESSION_PURGE_MAX_CHUNKS)
+    
+    return json_response(200, result)
+
+
+def sweep_expired_subscriptions(conn, chunk: int, max_chunks: int) -> dict:
+    """Переводит подписки с прошедшим expires_at из active в expired пачками по chunk строк,
+    самые старые первыми - по частичному idx_orders_expires_at. Каждая пачка - отдельная короткая
+    транзакция; max_chunks ограничивает работу за один вызов (0 - до конца).
+    Затем чистит revoked_access_tokens от заказов с прошедшим expires_at: все их токены
+    истекли по сроку, и список отзыва, который orders читает целиком, не растёт с историей."""
+    cursor = conn.cursor()
+    expired = 0
+    chunks = 0
+    finished = False
+    while not max_chunks or chunks < max_chunks:
+        cursor.execute("""
+            UPDATE orders SET subscription_status = 'expired', updated_at = NOW()
+            WHERE id IN (
+                SELECT id FROM orders
+                WHERE subscription_status = 'active' AND expires_at <= NOW()
+                ORDER BY expires_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (chunk,))
+        conn.commit()
+        expired += cursor.rowcount
+        chunks += 1
+        if cursor.rowcount < chunk:
+            finished = True
+            break
+    
+    cursor.execute("""
+        DELETE FROM revoked_access_tokens r
+        USING orders o
+        WHERE o.id = r.order_id AND o.expires_at <= NOW()
+    """)
+    revocations_deleted = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    
+    return {'subscriptions_expired': expired, 'revocations_deleted': revocations_deleted, 'finished': finished}
+
+
+def expire_subscriptions(conn) -> dict:
+    result = sweep_expired_subscriptions(conn, SUBSCRIPTION_SWEEP_CHUNK, SUBSCRIPTION_SWEEP_MAX_CHUNKS)
+    
+    return json_response(200, result)
+
+
+def main(argv=None) -> int:
+    """CLI для обслуживания без HTTP: python backend/admin/index.py export|import-catalog|import-users|purge-sessions|expire-subscriptions ..."""
+    parser = argparse.ArgumentParser(prog='admin')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    export_cmd = commands.add_parser('export', help='Выгрузка заказов, пользователей или каталога в gzip CSV/NDJSON')
+    export_cmd.add_argument('entity', choices=sorted(EXPORT_ENTITIES))
+    export_cmd.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    export_cmd.add_argument('--date-from')
+    export_cmd.add_argument('--date-to')
+    export_cmd.add_argument('--status')
+    export_cmd.add_argument('--role')
+    export_cmd.add_argument('-o', '--output', help='Файл назначения (по умолчанию stdout)')
+    
+    import_cmd = commands.add_parser('import-catalog', help='Загрузка каталога из CSV/NDJSON (можно .gz)')
+    import_cmd.add_argument('file', help='Файл каталога, - для stdin')
+    import_cmd.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    
+    users_cmd = commands.add_parser('import-users', help='Массовое создание пользователей из CSV/NDJSON (можно .gz)')
+    users_cmd.add_argument('file', help='Файл с колонками email, password, full_name, phone, role; - для stdin')
+    users_cmd.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    users_cmd.add_argument('--batch', type=int, default=USER_IMPORT_BATCH, help='Строк в одной вставке')
+    
+    purge_cmd = commands.add_parser('purge-sessions', help='Удаление истёкших сессий пачками')
+    purge_cmd.add_argument('--chunk', type=int, default=SESSION_PURGE_CHUNK)
+    purge_cmd.add_argument('--max-chunks', type=int, default=0, help='0 - пока не удалятся все')
+    
+    sweep_cmd = commands.add_parser('expire-subscriptions', help='Перевод истёкших подписок в expired пачками')
+    sweep_cmd.add_argument('--chunk', type=int, default=SUBSCRIPTION_SWEEP_CHUNK)
+    sweep_cmd.add_argument('--max-chunks', type=int, default=0, help='0 - пока не обработаются все')
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'export':
+        params = {
+            'date_from': args.date_from,
+            'date_to': args.date_to,
+            'status': args.status,
+            'role': args.role
+        }
+        out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            with db_connection() as conn:
+                if args.entity == 'catalog':
+                    total = write_catalog(conn, args.format, out)
+                else:
+                    total = write_export(conn, args.entity, args.format, params, out)
+        finally:
+            if args.output:
+                out.close()
+        print(f'Выгружено строк: {total}', file=sys.stderr)
+    elif args.command == 'import-catalog':
+        if args.file == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        elif args.file.endswith('.gz'):
+            stream = gzip.open(args.file, 'rt', encoding='utf-8-sig', newline='')
+        else:
+            stream = open(args.file, encoding='utf-8-sig', newline='')
+        with stream, db_connection() as conn:
+            result, errors = import_catalog(conn, args.format, stream)
+        if errors:
+            for error in errors:
+                print(f"Строка {error['row']}: {error['error']}", file=sys.stderr)
+            return 1
+        print(json.dumps(result))
+    elif args.command == 'import-users':
+        if args.file == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        elif args.file.endswith('.gz'):
+            stream = gzip.open(args.file, 'rt', encoding='utf-8-sig', newline='')
+        else:
+            stream = open(args.file, encoding='utf-8-sig', newline='')
+        with stream:
+            if args.format == 'csv':
+                rows = list(csv.DictReader(stream))
+            else:
+                rows = [json.loads(line) for line in stream if line.strip()]
+        with db_connection() as conn:
+            result = import_users(conn, rows, args.batch)
+        for error in result['failed']:
+            print(f"Строка {error['row']} ({error['email']}): {error['error']}", file=sys.stderr)
+        print(json.dumps(result['stats']))
+    elif args.command == 'purge-sessions':
+        with db_connection() as conn:
+            result = purge_expired_sessions(conn, args.chunk, args.max_chunks)
+        print(json.dumps(result))
+    elif args.command == 'expire-subscriptions':
+        with db_connection() as conn:
+            result = sweep_expired_subscriptions(conn, args.chunk, args.max_chunks)
+        print(json.dumps(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,603 @@
+import hashlib
 import json
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
 import secrets
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
 from psycopg2.extras import RealDictCursor
 import bcrypt
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '1') != '0'
+
+# Фазы текущего запроса: имя -> секунды. Поток на запрос, поэтому thread-local.
+_timing = threading.local()
+
+
+@contextmanager
+def timed(phase: str):
+    """Добавляет длительность блока к фазе текущего запроса (Server-Timing и лог запроса).
+    Фазы не пересекаются: запросы к БД внутри фазы считаются в неё, а не в db."""
+    phases = getattr(_timing, 'phases', None)
+    if phases is None or _timing.phase is not None:
+        yield
+        return
+    _timing.phase = phase
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - started
+        _timing.phase = None
+
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_SAMPLE = float(os.environ.get('SLOW_QUERY_SAMPLE', '0.1'))
+SLOW_QUERY_COOLDOWN = float(os.environ.get('SLOW_QUERY_COOLDOWN', '300'))
+
+# Когда последний раз снимали план для текста запроса - не чаще раза в SLOW_QUERY_COOLDOWN
+_explained = {}
+_explained_lock = threading.Lock()
+
+
+def param_shape(vars):
+    """Типы параметров без значений - чтобы в лог не попадали токены и персональные данные"""
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {key: type(value).__name__ for key, value in vars.items()}
+    return [type(value).__name__ for value in vars]
+
+
+def should_explain(text: str) -> bool:
+    if random.random() >= SLOW_QUERY_SAMPLE:
+        return False
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(text, -SLOW_QUERY_COOLDOWN) < SLOW_QUERY_COOLDOWN:
+            return False
+        _explained[text] = now
+        if len(_explained) > 1000:
+            _explained.clear()
+    return True
+
+
+EXPLAINABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def is_explainable(query: str) -> bool:
+    """Одиночный SELECT/INSERT/UPDATE/DELETE/WITH. В тексте из нескольких команд EXPLAIN покрыл бы
+    только первую, а остальные выполнились бы второй раз по-настоящему - такие запросы не трогаем."""
+    text = query.strip().rstrip(';')
+    if ';' in text:
+        return False
+    words = text.split(None, 1)
+    return bool(words) and words[0].upper() in EXPLAINABLE_STATEMENTS
+
+
+def explain_query(conn, query, vars) -> str:
+    """План медленного запроса. ANALYZE только для SELECT: запись нельзя выполнять второй раз,
+    для неё - обычный EXPLAIN. В открытой транзакции план снимается под savepoint,
+    чтобы ошибка EXPLAIN её не сломала."""
+    analyze = query.lstrip().upper().startswith('SELECT')
+    prefix = 'EXPLAIN (ANALYZE, BUFFERS)' if analyze else 'EXPLAIN'
+    in_transaction = not conn.autocommit and conn.info.transaction_status != TRANSACTION_STATUS_IDLE
+    cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        if in_transaction:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(f'{prefix} {query}', vars)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        except psycopg2.Error as e:
+            plan = f'EXPLAIN не удался: {e}'
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+        if in_transaction:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+    finally:
+        cursor.close()
+    return plan
+
+
+def log_slow_query(conn, query, vars, elapsed: float) -> None:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = query.as_string(conn)
+    text = ' '.join(query.split())
+    entry = {
+        'event': 'slow_query',
+        'duration_ms': round(elapsed * 1000, 1),
+        'query': text[:2000],
+        'params': param_shape(vars)
+    }
+    if is_explainable(query) and should_explain(text):
+        entry['plan'] = explain_query(conn, query, vars)
+    print(json.dumps(entry, ensure_ascii=False))
+
+
+class TimedCursorMixin:
+    """Время каждого запроса к БД идёт в фазу db, число запросов и прочитанных строк - в лог запроса.
+    Запросы дольше SLOW_QUERY_MS пишутся в лог медленных запросов."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        with timed('db'):
+            result = super().execute(query, vars)
+        elapsed = time.perf_counter() - started
+        if getattr(_timing, 'phases', None) is not None:
+            _timing.queries += 1
+            if self.description is not None:
+                _timing.rows += max(self.rowcount, 0)
+        # Для именованных курсоров execute - только DECLARE, строки читаются позже
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS and not self.name:
+            log_slow_query(self.connection, query, vars, elapsed)
+        return result
+
+
+class TimedCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or TimedCursor
+        kwargs['cursor_factory'] = TimedRealDictCursor if factory is RealDictCursor else factory
+        return super().cursor(*args, **kwargs)
+
+
+def timed_handler(function: str):
+    """Замеряет фазы запроса: пишет JSON-строку в лог и добавляет заголовок Server-Timing"""
+    def decorate(handler):
+        @wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            if not REQUEST_TIMING:
+                return handler(event, context)
+            _timing.phases = {}
+            _timing.phase = None
+            _timing.rows = 0
+            _timing.queries = 0
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+                total = time.perf_counter() - started
+                phases, rows, queries = _timing.phases, _timing.rows, _timing.queries
+            finally:
+                _timing.phases = None
+            
+            # app - всё, что не попало в фазы: логика обработчика и чтение строк
+            phases['app'] = max(total - sum(phases.values()), 0.0)
+            metrics = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in phases.items()]
+            metrics.append(f'total;dur={total * 1000:.1f}')
+            metrics.append(f'queries;desc="{queries}"')
+            print(json.dumps({
+                'event': 'request',
+                'function': function,
+                'method': event.get('httpMethod'),
+                'action': (event.get('queryStringParameters') or {}).get('action', ''),
+                'status': response.get('statusCode'),
+                'duration_ms': round(total * 1000, 1),
+                'phases': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+                'rows': rows,
+                'queries': queries
+            }))
+            return {
+                **response,
+                'headers': {
+                    **(response.get('headers') or {}),
+                    'Server-Timing': ', '.join(metrics),
+                    'Timing-Allow-Origin': '*'
+                }
+            }
+        return wrapper
+    return decorate
+
+
+# Общие заголовки JSON-ответов. Один экземпляр на все ответы - не изменять на месте,
+# дополнительные заголовки передаются в json_response и сливаются в новый словарь.
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def json_default(value):
+    """Типы из psycopg2, которых не знает json: NUMERIC -> число, даты -> ISO 8601"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Тип {type(value).__name__} не сериализуется в JSON')
+
+
+_json_encoder = json.JSONEncoder(default=json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(data) -> str:
+    """Сериализация тела ответа: orjson, если установлен, иначе стандартный json с тем же результатом"""
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return _json_encoder.encode(data)
+
+
+def json_response(status: int, data, headers: dict = None) -> dict:
+    with timed('serialize'):
+        body = dumps(data)
+    return {
+        'statusCode': status,
+        'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+
+class ConnectionPool:
+    """Пул соединений с БД уровня модуля - живёт между вызовами в тёплом инстансе функции.
+    Ограничивает число соединений, проверяет простаивавшие соединения перед выдачей
+    и сбрасывает (rollback/закрытие) соединения при возврате."""
+
+    def __init__(self, dsn: str, maxconn: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def getconn(self, timeout: float = None):
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise PoolError('Пул соединений с БД исчерпан')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+                conn, released_at = item
+                if self._is_healthy(conn, released_at):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if self._reset(conn):
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reset(self, conn) -> bool:
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status == TRANSACTION_STATUS_IDLE:
+            return True
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'], DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Выдаёт соединение из пула и всегда возвращает его обратно, даже при исключении"""
+    pool = get_pool()
+    with timed('connect'):
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '1024'))
+SESSION_CACHE_SYNC_INTERVAL = float(os.environ.get('SESSION_CACHE_SYNC_INTERVAL', '2'))
+
+
+class SessionCache:
+    """LRU-кэш token -> пользователь с ограниченным временем жизни записей.
+    Запись живёт не дольше SESSION_CACHE_TTL и никогда не переживает expires_at сессии."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            user, deadline = item
+            if deadline <= time.monotonic():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return dict(user)
+
+    def put(self, token: str, user: dict, expires_at: datetime) -> None:
+        ttl = min(self.ttl, (expires_at - datetime.now()).total_seconds())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[token] = (dict(user), time.monotonic() + ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._items.pop(token, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in [t for t, (u, _) in self._items.items() if u['id'] == user_id]:
+                del self._items[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+_session_generation = (None, 0.0)
+
+# Выход, смена пароля и правка пользователя сдвигают счётчик, и кэши сессий во всех функциях сбрасываются
+BUMP_SESSION_GENERATION = "UPDATE cache_generations SET generation = generation + 1 WHERE name = 'sessions'"
+
+SESSION_MAX_PER_USER = int(os.environ.get('SESSION_MAX_PER_USER', '10'))
+
+
+def sync_session_cache(conn) -> None:
+    """Сбрасывает кэш сессий, если сессии или пользователи менялись в другом инстансе
+    (счётчик cache_generations.sessions). Счётчик читается не чаще раза в SESSION_CACHE_SYNC_INTERVAL секунд."""
+    global _session_generation
+    generation, checked_at = _session_generation
+    if time.monotonic() - checked_at < SESSION_CACHE_SYNC_INTERVAL:
+        return
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT generation FROM cache_generations WHERE name = 'sessions'")
+    row = cursor.fetchone()
+    cursor.close()
+    
+    current = row[0] if row else 0
+    if current != generation:
+        _session_cache.clear()
+    _session_generation = (current, time.monotonic())
+
+
+def resolve_session(conn, token: str):
+    """Возвращает пользователя по токену сессии: сначала из кэша, при промахе - из БД"""
+    with timed('session'):
+        sync_session_cache(conn)
+    user = _session_cache.get(token)
+    if user is not None:
+        return user
+    
+    with timed('session'):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT u.id, u.email, u.full_name, u.phone, u.role, s.expires_at
+            FROM users u
+            JOIN sessions s ON u.id = s.user_id
+            WHERE s.token = %s AND s.expires_at > NOW()
+        """, (token,))
+        row = cursor.fetchone()
+        cursor.close()
+    
+    if not row:
+        return None
+    
+    user = {
+        'id': row['id'],
+        'email': row['email'],
+        'full_name': row['full_name'],
+        'phone': row['phone'],
+        'role': row['role']
+    }
+    _session_cache.put(token, user, row['expires_at'])
+    return user
+
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '2'))
+
+_bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt') if BCRYPT_WORKERS > 0 else None
+
+
+def run_bcrypt(fn, *args):
+    """Выполняет bcrypt в ограниченном пуле потоков (bcrypt отпускает GIL на время хеширования),
+    чтобы медленный хеш не блокировал другие запросы; при BCRYPT_WORKERS=0 - в текущем потоке"""
+    with timed('bcrypt'):
+        if _bcrypt_executor is None:
+            return fn(*args)
+        return _bcrypt_executor.submit(fn, *args).result()
+
+
+def hash_password(password: str) -> str:
+    return run_bcrypt(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def check_password(password: str, password_hash: str) -> bool:
+    return run_bcrypt(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """True, если хеш создан с другой стоимостью, чем BCRYPT_ROUNDS ($2b$<cost>$...)"""
+    try:
+        return int(password_hash.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+LOGIN_RATE_CAPACITY = float(os.environ.get('LOGIN_RATE_CAPACITY', '10'))
+LOGIN_RATE_PER_MINUTE = float(os.environ.get('LOGIN_RATE_PER_MINUTE', '5'))
+LOGIN_RATE_LOCAL_KEYS = int(os.environ.get('LOGIN_RATE_LOCAL_KEYS', '10000'))
+# Отказы пишутся в лог сводкой не чаще раза в THROTTLE_LOG_INTERVAL секунд, а не строкой на каждый
+THROTTLE_LOG_INTERVAL = float(os.environ.get('THROTTLE_LOG_INTERVAL', '60'))
+
+
+class LocalBuckets:
+    """In-process token bucket по ключу. Хранит оценку остатка сверху (синхронизируется с БД),
+    поэтому пустое локальное ведро - достаточное основание отказать без запроса к БД."""
+
+    def __init__(self, capacity: float, per_second: float, maxsize: int):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_consume(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._items.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.per_second)
+            allowed = tokens >= 1
+            self._items[key] = (tokens - 1 if allowed else tokens, now)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+            return allowed
+
+    def sync(self, key: str, tokens: float) -> None:
+        with self._lock:
+            self._items[key] = (tokens, time.monotonic())
+
+
+_login_buckets = LocalBuckets(LOGIN_RATE_CAPACITY, LOGIN_RATE_PER_MINUTE / 60, LOGIN_RATE_LOCAL_KEYS)
+_throttle_shed = {'local': 0, 'shared': 0}
+_throttle_log = {'logged_at': time.monotonic(), 'pending': {}}
+
+
+def client_ip(event: dict) -> str:
+    """IP клиента по данным шлюза. X-Forwarded-For не используется: его задаёт сам клиент,
+    и подставной адрес обходил бы ограничение по IP. Без sourceIp ограничение идёт только по email."""
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or ''
+
+
+def throttle(conn, action: str, keys: list) -> bool:
+    """Token bucket по email и IP перед bcrypt. Сначала локальное ведро (отказ без БД),
+    затем общее состояние в rate_limits - одним upsert по всем ключам. True - попытку можно обрабатывать.
+    Ключ - sha256 от action:ключ: длина email не ограничена, а rate_limits.key - VARCHAR(400)."""
+    keys = [hashlib.sha256(f'{action}:{k}'.encode('utf-8')).hexdigest() for k in keys if k]
+    if not keys:
+        return True
+    
+    if not all([_login_buckets.try_consume(key) for key in keys]):
+        return shed(action, 'local')
+    
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        INSERT INTO rate_limits AS r (key, tokens, updated_at)
+        VALUES {', '.join(['(%s, %s - 1, NOW())'] * len(keys))}
+        ON CONFLICT (key) DO UPDATE
+        SET tokens = GREATEST(-1, LEAST(
+                EXCLUDED.tokens + 1,
+                r.tokens + EXTRACT(EPOCH FROM (NOW() - r.updated_at)) * %s
+            ) - 1),
+            updated_at = NOW()
+        RETURNING key, tokens
+    """, (*[v for key in keys for v in (key, LOGIN_RATE_CAPACITY)], LOGIN_RATE_PER_MINUTE / 60))
+    rows = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    
+    for key, tokens in rows:
+        _login_buckets.sync(key, tokens)
+    if any(tokens < 0 for _, tokens in rows):
+        return shed(action, 'shared')
+    return True
+
+
+def shed(action: str, layer: str) -> bool:
+    """Учитывает отказ в счётчиках и раз в THROTTLE_LOG_INTERVAL пишет сводку отказов по action:layer"""
+    _throttle_shed[layer] += 1
+    pending = _throttle_log['pending']
+    pending[f'{action}:{layer}'] = pending.get(f'{action}:{layer}', 0) + 1
+    now = time.monotonic()
+    if now - _throttle_log['logged_at'] >= THROTTLE_LOG_INTERVAL:
+        print(json.dumps({'event': 'throttle_shed', 'since_last': pending, 'shed': _throttle_shed}))
+        _throttle_log['logged_at'] = now
+        _throttle_log['pending'] = {}
+    return False
+
+
+def throttled_response() -> dict:
+    return json_response(
+        429,
+        {'error': 'Слишком много попыток. Попробуйте позже'},
+        {'Retry-After': str(int(60 / LOGIN_RATE_PER_MINUTE) + 1)}
+    )
+
+
+@timed_handler('auth')
 def handler(event: dict, context) -> dict:
     """API для регистрации, авторизации и управления сессиями пользователей"""
     method = event.get('httpMethod', 'GET')
@@ -26,129 +618,114 @@ def handler(event: dict, context) -> dict:
     path = event.get('queryStringParameters', {}).get('action', '')
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        with db_connection() as conn:
         
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
+            if method == 'POST':
+                body = json.loads(event.get('body', '{}'))
             
-            if path == 'register':
-                return register_user(conn, body)
-            elif path == 'login':
-                return login_user(conn, body)
-            elif path == 'logout':
-                return logout_user(conn, event)
-            elif path == 'change-password':
-                return change_password(conn, event, body)
+                if path == 'register':
+                    return register_user(conn, body, client_ip(event))
+                elif path == 'login':
+                    return login_user(conn, body, client_ip(event))
+                elif path == 'logout':
+                    return logout_user(conn, event)
+                elif path == 'change-password':
+                    return change_password(conn, event, body)
         
-        elif method == 'GET':
-            if path == 'verify':
-                return verify_session(conn, event)
+            elif method == 'GET':
+                if path == 'verify':
+                    return verify_session(conn, event)
+                elif path == 'throttle-stats':
+                    return get_throttle_stats(conn, event)
         
-        conn.close()
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
+            return json_response(404, {'error': 'Endpoint not found'})
         
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return json_response(500, {'error': str(e)})
 
 
-def register_user(conn, body: dict) -> dict:
+def register_user(conn, body: dict, ip: str = '') -> dict:
     email = body.get('email', '').strip().lower()
     password = body.get('password', '')
     full_name = body.get('full_name', '').strip()
     phone = body.get('phone', '').strip()
     
     if not email or not password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Email и пароль обязательны'}),
-            'isBase64Encoded': False
-        }
+        return json_response(400, {'error': 'Email и пароль обязательны'})
     
     if len(password) < 6:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Пароль должен быть минимум 6 символов'}),
-            'isBase64Encoded': False
-        }
-    
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-    if cursor.fetchone():
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 409,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Пользователь с таким email уже существует'}),
-            'isBase64Encoded': False
-        }
-    
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    
-    cursor.execute(
-        "INSERT INTO users (email, password_hash, full_name, phone) VALUES (%s, %s, %s, %s) RETURNING id, email, full_name, role",
-        (email, password_hash, full_name, phone)
-    )
-    user = cursor.fetchone()
+        return json_response(400, {'error': 'Пароль должен быть минимум 6 символов'})
     
-    cursor.execute(
-        "INSERT INTO wallets (user_id, balance, currency) VALUES (%s, %s, %s)",
-        (user['id'], 0.00, 'RUB')
-    )
+    if not throttle(conn, 'register', [f'email:{email}', f'ip:{ip}' if ip else '']):
+        return throttled_response()
     
+    password_hash = hash_password(password)
     token = secrets.token_urlsafe(32)
     expires_at = datetime.now() + timedelta(days=30)
     
-    cursor.execute(
-        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s)",
-        (user['id'], token, expires_at)
-    )
+    # Пользователь, кошелёк и сессия - одним запросом. Занятый email отсекает ON CONFLICT:
+    # строки нет - кошелёк и сессия не создаются, отвечаем 409
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("""
+        WITH new_user AS (
+            INSERT INTO users (email, password_hash, full_name, phone)
+            VALUES (%(email)s, %(password_hash)s, %(full_name)s, %(phone)s)
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id, email, full_name, phone, role
+        ), wallet AS (
+            INSERT INTO wallets (user_id, balance, currency)
+            SELECT id, 0.00, 'RUB' FROM new_user
+        ), session AS (
+            INSERT INTO sessions (user_id, token, expires_at)
+            SELECT id, %(token)s, %(expires_at)s FROM new_user
+        )
+        SELECT id, email, full_name, phone, role FROM new_user
+    """, {
+        'email': email,
+        'password_hash': password_hash,
+        'full_name': full_name,
+        'phone': phone,
+        'token': token,
+        'expires_at': expires_at
+    })
+    user = cursor.fetchone()
+    
+    if not user:
+        conn.rollback()
+        cursor.close()
+        return json_response(409, {'error': 'Пользователь с таким email уже существует'})
     
     conn.commit()
     cursor.close()
-    conn.close()
-    
-    return {
-        'statusCode': 201,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'message': 'Регистрация успешна',
-            'token': token,
-            'user': {
-                'id': user['id'],
-                'email': user['email'],
-                'full_name': user['full_name'],
-                'role': user['role']
-            }
-        }),
-        'isBase64Encoded': False
-    }
+    _session_cache.put(token, {
+        'id': user['id'],
+        'email': user['email'],
+        'full_name': user['full_name'],
+        'phone': user['phone'],
+        'role': user['role']
+    }, expires_at)
+    
+    return json_response(201, {
+        'message': 'Регистрация успешна',
+        'token': token,
+        'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'full_name': user['full_name'],
+            'role': user['role']
+        }
+    })
 
 
-def login_user(conn, body: dict) -> dict:
+def login_user(conn, body: dict, ip: str = '') -> dict:
     email = body.get('email', '').strip().lower()
     password = body.get('password', '')
     
     if not email or not password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Email и пароль обязательны'}),
-            'isBase64Encoded': False
-        }
+        return json_response(400, {'error': 'Email и пароль обязательны'})
+    
+    if not throttle(conn, 'login', [f'email:{email}', f'ip:{ip}' if ip else '']):
+        return throttled_response()
     
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
@@ -158,44 +735,75 @@ def login_user(conn, body: dict) -> dict:
     )
     user = cursor.fetchone()
     
-    if not user or not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+    if not user or not check_password(password, user['password_hash']):
         cursor.close()
-        conn.close()
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный email или пароль'}),
-            'isBase64Encoded': False
-        }
+        return json_response(401, {'error': 'Неверный email или пароль'})
+    
+    # Пароль верный - заодно переводим хеш на текущую стоимость BCRYPT_ROUNDS
+    new_hash = hash_password(password) if needs_rehash(user['password_hash']) else None
     
     token = secrets.token_urlsafe(32)
     expires_at = datetime.now() + timedelta(days=30)
     
-    cursor.execute(
-        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s)",
-        (user['id'], token, expires_at)
-    )
+    open_session(cursor, user['id'], token, expires_at, new_hash)
     
     conn.commit()
     cursor.close()
-    conn.close()
-    
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'message': 'Вход выполнен успешно',
-            'token': token,
-            'user': {
-                'id': user['id'],
-                'email': user['email'],
-                'full_name': user['full_name'],
-                'phone': user['phone'],
-                'role': user['role']
-            }
-        }),
-        'isBase64Encoded': False
-    }
+    _session_cache.put(token, {
+        'id': user['id'],
+        'email': user['email'],
+        'full_name': user['full_name'],
+        'phone': user['phone'],
+        'role': user['role']
+    }, expires_at)
+    
+    return json_response(200, {
+        'message': 'Вход выполнен успешно',
+        'token': token,
+        'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'full_name': user['full_name'],
+            'phone': user['phone'],
+            'role': user['role']
+        }
+    })
+
+
+def open_session(cursor, user_id: int, token: str, expires_at, new_password_hash: str = None) -> None:
+    """Одним запросом: создаёт сессию, при необходимости обновляет хеш пароля и оставляет
+    пользователю не больше SESSION_MAX_PER_USER живых сессий, удаляя самые старые.
+    Части CTE видят таблицу до вставки, поэтому из прежних сессий остаётся SESSION_MAX_PER_USER - 1.
+    Если старые сессии удалены, сдвигается счётчик sessions - их сбросят и кэши других функций."""
+    cursor.execute(f"""
+        WITH rehashed AS (
+            UPDATE users SET password_hash = %(hash)s, updated_at = NOW()
+            WHERE id = %(user_id)s AND %(hash)s IS NOT NULL
+        ), created AS (
+            INSERT INTO sessions (user_id, token, expires_at)
+            VALUES (%(user_id)s, %(token)s, %(expires_at)s)
+        ), evicted AS (
+            DELETE FROM sessions WHERE %(evict)s AND id IN (
+                SELECT id FROM sessions
+                WHERE user_id = %(user_id)s AND expires_at > NOW()
+                ORDER BY created_at DESC, id DESC
+                OFFSET %(keep)s
+            )
+            RETURNING token
+        ), bumped AS (
+            {BUMP_SESSION_GENERATION} AND EXISTS (SELECT 1 FROM evicted)
+        )
+        SELECT token FROM evicted
+    """, {
+        'hash': new_password_hash,
+        'user_id': user_id,
+        'token': token,
+        'expires_at': expires_at,
+        'evict': SESSION_MAX_PER_USER > 0,
+        'keep': max(SESSION_MAX_PER_USER - 1, 0)
+    })
+    for row in cursor.fetchall():
+        _session_cache.invalidate(row['token'])
 
 
 def logout_user(conn, event: dict) -> dict:
@@ -204,25 +812,21 @@ def logout_user(conn, event: dict) -> dict:
     token = token.replace('Bearer ', '')
     
     if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Токен не предоставлен'}),
-            'isBase64Encoded': False
-        }
+        return json_response(401, {'error': 'Токен не предоставлен'})
     
     cursor = conn.cursor()
-    cursor.execute("UPDATE sessions SET expires_at = NOW() WHERE token = %s", (token,))
+    cursor.execute(f"""
+        WITH ended AS (
+            UPDATE sessions SET expires_at = NOW() WHERE token = %s
+            RETURNING id
+        )
+        {BUMP_SESSION_GENERATION} AND EXISTS (SELECT 1 FROM ended)
+    """, (token,))
     conn.commit()
     cursor.close()
-    conn.close()
+    _session_cache.invalidate(token)
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Выход выполнен успешно'}),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'message': 'Выход выполнен успешно'})
 
 
 def verify_session(conn, event: dict) -> dict:
@@ -231,52 +835,23 @@ def verify_session(conn, event: dict) -> dict:
     token = token.replace('Bearer ', '')
     
     if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Токен не предоставлен. Headers: {list(headers.keys())}'}),
-            'isBase64Encoded': False
-        }
+        return json_response(401, {'error': f'Токен не предоставлен. Headers: {list(headers.keys())}'})
     
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(
-        """
-        SELECT u.id, u.email, u.full_name, u.phone, u.role 
-        FROM users u
-        JOIN sessions s ON u.id = s.user_id
-        WHERE s.token = %s AND s.expires_at > NOW()
-        """,
-        (token,)
-    )
-    user = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
+    user = resolve_session(conn, token)
     
     if not user:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Сессия недействительна'}),
-            'isBase64Encoded': False
+        return json_response(401, {'error': 'Сессия недействительна'})
+    
+    return json_response(200, {
+        'valid': True,
+        'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'full_name': user['full_name'],
+            'phone': user['phone'],
+            'role': user['role']
         }
-    
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'valid': True,
-            'user': {
-                'id': user['id'],
-                'email': user['email'],
-                'full_name': user['full_name'],
-                'phone': user['phone'],
-                'role': user['role']
-            }
-        }),
-        'isBase64Encoded': False
-    }
+    })
 
 
 def change_password(conn, event: dict, body: dict) -> dict:
@@ -285,31 +860,16 @@ def change_password(conn, event: dict, body: dict) -> dict:
     token = token.replace('Bearer ', '')
     
     if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуется авторизация'}),
-            'isBase64Encoded': False
-        }
+        return json_response(401, {'error': 'Требуется авторизация'})
     
     old_password = body.get('old_password', '')
     new_password = body.get('new_password', '')
     
     if not old_password or not new_password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Старый и новый пароли обязательны'}),
-            'isBase64Encoded': False
-        }
+        return json_response(400, {'error': 'Старый и новый пароли обязательны'})
     
     if len(new_password) < 6:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Новый пароль должен быть минимум 6 символов'}),
-            'isBase64Encoded': False
-        }
+        return json_response(400, {'error': 'Новый пароль должен быть минимум 6 символов'})
     
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
@@ -326,38 +886,35 @@ def change_password(conn, event: dict, body: dict) -> dict:
     
     if not user:
         cursor.close()
-        conn.close()
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Сессия недействительна'}),
-            'isBase64Encoded': False
-        }
+        return json_response(401, {'error': 'Сессия недействительна'})
     
-    if not bcrypt.checkpw(old_password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+    if not check_password(old_password, user['password_hash']):
         cursor.close()
-        conn.close()
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный текущий пароль'}),
-            'isBase64Encoded': False
-        }
+        return json_response(400, {'error': 'Неверный текущий пароль'})
     
-    new_password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    new_password_hash = hash_password(new_password)
     
-    cursor.execute(
-        "UPDATE users SET password_hash = %s, updated_at = NOW() WHERE id = %s",
-        (new_password_hash, user['id'])
-    )
+    cursor.execute(f"""
+        WITH changed AS (
+            UPDATE users SET password_hash = %s, updated_at = NOW() WHERE id = %s
+        )
+        {BUMP_SESSION_GENERATION}
+    """, (new_password_hash, user['id']))
     
     conn.commit()
     cursor.close()
-    conn.close()
+    _session_cache.invalidate_user(user['id'])
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'message': 'Пароль успешно изменен'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    return json_response(200, {'message': 'Пароль успешно изменен'})
+
+
+def get_throttle_stats(conn, event: dict) -> dict:
+    """Сколько попыток входа/регистрации отсёк этот инстанс (локально и по общему состоянию в БД)"""
+    headers = event.get('headers', {})
+    token = headers.get('x-authorization', '') or headers.get('X-Authorization', '')
+    user = resolve_session(conn, token.replace('Bearer ', '')) if token else None
+    
+    if not user or user['role'] != 'admin':
+        return json_response(403, {'error': 'Доступ запрещен. Требуются права администратора'})
+    
+    return json_response(200, {'shed': _throttle_shed})
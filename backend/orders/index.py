@@ -1,9 +1,517 @@
+import base64
+import hashlib
+import hmac
 import json
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from datetime import date, datetime
+from decimal import Decimal
 import secrets
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
 from psycopg2.extras import RealDictCursor
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '1') != '0'
+
+# Фазы текущего запроса: имя -> секунды. Поток на запрос, поэтому thread-local.
+_timing = threading.local()
+
+
+@contextmanager
+def timed(phase: str):
+    """Добавляет длительность блока к фазе текущего запроса (Server-Timing и лог запроса).
+    Фазы не пересекаются: запросы к БД внутри фазы считаются в неё, а не в db."""
+    phases = getattr(_timing, 'phases', None)
+    if phases is None or _timing.phase is not None:
+        yield
+        return
+    _timing.phase = phase
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - started
+        _timing.phase = None
+
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_SAMPLE = float(os.environ.get('SLOW_QUERY_SAMPLE', '0.1'))
+SLOW_QUERY_COOLDOWN = float(os.environ.get('SLOW_QUERY_COOLDOWN', '300'))
+
+# Когда последний раз снимали план для текста запроса - не чаще раза в SLOW_QUERY_COOLDOWN
+_explained = {}
+_explained_lock = threading.Lock()
+
+
+def param_shape(vars):
+    """Типы параметров без значений - чтобы в лог не попадали токены и персональные данные"""
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {key: type(value).__name__ for key, value in vars.items()}
+    return [type(value).__name__ for value in vars]
+
+
+def should_explain(text: str) -> bool:
+    if random.random() >= SLOW_QUERY_SAMPLE:
+        return False
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(text, -SLOW_QUERY_COOLDOWN) < SLOW_QUERY_COOLDOWN:
+            return False
+        _explained[text] = now
+        if len(_explained) > 1000:
+            _explained.clear()
+    return True
+
+
+EXPLAINABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def is_explainable(query: str) -> bool:
+    """Одиночный SELECT/INSERT/UPDATE/DELETE/WITH. В тексте из нескольких команд EXPLAIN покрыл бы
+    только первую, а остальные выполнились бы второй раз по-настоящему - такие запросы не трогаем."""
+    text = query.strip().rstrip(';')
+    if ';' in text:
+        return False
+    words = text.split(None, 1)
+    return bool(words) and words[0].upper() in EXPLAINABLE_STATEMENTS
+
+
+def explain_query(conn, query, vars) -> str:
+    """План медленного запроса. ANALYZE только для SELECT: запись нельзя выполнять второй раз,
+    для неё - обычный EXPLAIN. В открытой транзакции план снимается под savepoint,
+    чтобы ошибка EXPLAIN её не сломала."""
+    analyze = query.lstrip().upper().startswith('SELECT')
+    prefix = 'EXPLAIN (ANALYZE, BUFFERS)' if analyze else 'EXPLAIN'
+    in_transaction = not conn.autocommit and conn.info.transaction_status != TRANSACTION_STATUS_IDLE
+    cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        if in_transaction:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(f'{prefix} {query}', vars)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        except psycopg2.Error as e:
+            plan = f'EXPLAIN не удался: {e}'
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+        if in_transaction:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+    finally:
+        cursor.close()
+    return plan
+
+
+def log_slow_query(conn, query, vars, elapsed: float) -> None:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = query.as_string(conn)
+    text = ' '.join(query.split())
+    entry = {
+        'event': 'slow_query',
+        'duration_ms': round(elapsed * 1000, 1),
+        'query': text[:2000],
+        'params': param_shape(vars)
+    }
+    if is_explainable(query) and should_explain(text):
+        entry['plan'] = explain_query(conn, query, vars)
+    print(json.dumps(entry, ensure_ascii=False))
+
+
+class TimedCursorMixin:
+    """Время каждого запроса к БД идёт в фазу db, число запросов и прочитанных строк - в лог запроса.
+    Запросы дольше SLOW_QUERY_MS пишутся в лог медленных запросов."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        with timed('db'):
+            result = super().execute(query, vars)
+        elapsed = time.perf_counter() - started
+        if getattr(_timing, 'phases', None) is not None:
+            _timing.queries += 1
+            if self.description is not None:
+                _timing.rows += max(self.rowcount, 0)
+        # Для именованных курсоров execute - только DECLARE, строки читаются позже
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS and not self.name:
+            log_slow_query(self.connection, query, vars, elapsed)
+        return result
+
+
+class TimedCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or TimedCursor
+        kwargs['cursor_factory'] = TimedRealDictCursor if factory is RealDictCursor else factory
+        return super().cursor(*args, **kwargs)
+
+
+def timed_handler(function: str):
+    """Замеряет фазы запроса: пишет JSON-строку в лог и добавляет заголовок Server-Timing"""
+    def decorate(handler):
+        @wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            if not REQUEST_TIMING:
+                return handler(event, context)
+            _timing.phases = {}
+            _timing.phase = None
+            _timing.rows = 0
+            _timing.queries = 0
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+                total = time.perf_counter() - started
+                phases, rows, queries = _timing.phases, _timing.rows, _timing.queries
+            finally:
+                _timing.phases = None
+            
+            # app - всё, что не попало в фазы: логика обработчика и чтение строк
+            phases['app'] = max(total - sum(phases.values()), 0.0)
+            metrics = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in phases.items()]
+            metrics.append(f'total;dur={total * 1000:.1f}')
+            metrics.append(f'queries;desc="{queries}"')
+            print(json.dumps({
+                'event': 'request',
+                'function': function,
+                'method': event.get('httpMethod'),
+                'action': (event.get('queryStringParameters') or {}).get('action', ''),
+                'status': response.get('statusCode'),
+                'duration_ms': round(total * 1000, 1),
+                'phases': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+                'rows': rows,
+                'queries': queries
+            }))
+            return {
+                **response,
+                'headers': {
+                    **(response.get('headers') or {}),
+                    'Server-Timing': ', '.join(metrics),
+                    'Timing-Allow-Origin': '*'
+                }
+            }
+        return wrapper
+    return decorate
+
+
+# Общие заголовки JSON-ответов. Один экземпляр на все ответы - не изменять на месте,
+# дополнительные заголовки передаются в json_response и сливаются в новый словарь.
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def json_default(value):
+    """Типы из psycopg2, которых не знает json: NUMERIC -> число, даты -> ISO 8601"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Тип {type(value).__name__} не сериализуется в JSON')
+
+
+_json_encoder = json.JSONEncoder(default=json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(data) -> str:
+    """Сериализация тела ответа: orjson, если установлен, иначе стандартный json с тем же результатом"""
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return _json_encoder.encode(data)
+
+
+def json_response(status: int, data, headers: dict = None) -> dict:
+    with timed('serialize'):
+        body = dumps(data)
+    return {
+        'statusCode': status,
+        'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+
+class ConnectionPool:
+    """Пул соединений с БД уровня модуля - живёт между вызовами в тёплом инстансе функции.
+    Ограничивает число соединений, проверяет простаивавшие соединения перед выдачей
+    и сбрасывает (rollback/закрытие) соединения при возврате."""
+
+    def __init__(self, dsn: str, maxconn: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def getconn(self, timeout: float = None):
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise PoolError('Пул соединений с БД исчерпан')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+                conn, released_at = item
+                if self._is_healthy(conn, released_at):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if self._reset(conn):
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reset(self, conn) -> bool:
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status == TRANSACTION_STATUS_IDLE:
+            return True
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'], DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Выдаёт соединение из пула и всегда возвращает его обратно, даже при исключении"""
+    pool = get_pool()
+    with timed('connect'):
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '1024'))
+SESSION_CACHE_SYNC_INTERVAL = float(os.environ.get('SESSION_CACHE_SYNC_INTERVAL', '2'))
+
+
+class SessionCache:
+    """LRU-кэш token -> пользователь с ограниченным временем жизни записей.
+    Запись живёт не дольше SESSION_CACHE_TTL и никогда не переживает expires_at сессии."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            user, deadline = item
+            if deadline <= time.monotonic():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return dict(user)
+
+    def put(self, token: str, user: dict, expires_at: datetime) -> None:
+        ttl = min(self.ttl, (expires_at - datetime.now()).total_seconds())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[token] = (dict(user), time.monotonic() + ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._items.pop(token, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in [t for t, (u, _) in self._items.items() if u['id'] == user_id]:
+                del self._items[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+_session_generation = (None, 0.0)
+
+ACCESS_TOKEN_SECRET = os.environ.get('ACCESS_TOKEN_SECRET', '')
+ACCESS_REVOCATION_TTL = float(os.environ.get('ACCESS_REVOCATION_TTL', '30'))
+CHECK_ACCESS_BATCH_MAX = int(os.environ.get('CHECK_ACCESS_BATCH_MAX', '500'))
+ACCESS_CACHE_TTL = float(os.environ.get('ACCESS_CACHE_TTL', '60'))
+ACCESS_CACHE_NEGATIVE_TTL = float(os.environ.get('ACCESS_CACHE_NEGATIVE_TTL', '10'))
+ACCESS_CACHE_SIZE = int(os.environ.get('ACCESS_CACHE_SIZE', '4096'))
+ACCESS_CACHE_SYNC_INTERVAL = float(os.environ.get('ACCESS_CACHE_SYNC_INTERVAL', '2'))
+
+# Статус подписки хранится в orders.subscription_status (триггер + sweeper admin expire-subscriptions).
+# Между проходами sweeper'а истёкшая подписка ещё помечена active - это закрывает одно сравнение
+SUBSCRIPTION_STATUS_SQL = "CASE WHEN o.subscription_status = 'active' AND o.expires_at <= NOW() THEN 'expired' ELSE o.subscription_status END"
+
+
+class AccessCache:
+    """LRU-кэш результатов check_access: token -> (HTTP-статус, тело) со своим сроком жизни у каждой записи"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            result, deadline = item
+            if deadline <= time.monotonic():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return result
+
+    def put(self, token: str, result: tuple, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[token] = (result, time.monotonic() + ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_access_cache = AccessCache(ACCESS_CACHE_SIZE)
+_access_generation = (None, 0.0)
+
+_revoked_orders = None
+
+
+def sync_session_cache(conn) -> None:
+    """Сбрасывает кэш сессий, если сессии или пользователи менялись в другом инстансе
+    (счётчик cache_generations.sessions). Счётчик читается не чаще раза в SESSION_CACHE_SYNC_INTERVAL секунд."""
+    global _session_generation
+    generation, checked_at = _session_generation
+    if time.monotonic() - checked_at < SESSION_CACHE_SYNC_INTERVAL:
+        return
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT generation FROM cache_generations WHERE name = 'sessions'")
+    row = cursor.fetchone()
+    cursor.close()
+    
+    current = row[0] if row else 0
+    if current != generation:
+        _session_cache.clear()
+    _session_generation = (current, time.monotonic())
+
+
+def resolve_session(conn, token: str):
+    """Возвращает пользователя по токену сессии: сначала из кэша, при промахе - из БД"""
+    with timed('session'):
+        sync_session_cache(conn)
+    user = _session_cache.get(token)
+    if user is not None:
+        return user
+    
+    with timed('session'):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT u.id, u.email, u.full_name, u.phone, u.role, s.expires_at
+            FROM users u
+            JOIN sessions s ON u.id = s.user_id
+            WHERE s.token = %s AND s.expires_at > NOW()
+        """, (token,))
+        row = cursor.fetchone()
+        cursor.close()
+    
+    if not row:
+        return None
+    
+    user = {
+        'id': row['id'],
+        'email': row['email'],
+        'full_name': row['full_name'],
+        'phone': row['phone'],
+        'role': row['role']
+    }
+    _session_cache.put(token, user, row['expires_at'])
+    return user
+
+
+@timed_handler('orders')
 def handler(event: dict, context) -> dict:
     """API для управления заказами: создание, оплата, подтверждение доступа, проверка подписки"""
     method = event.get('httpMethod', 'GET')
@@ -27,83 +535,69 @@ def handler(event: dict, context) -> dict:
     token = token.replace('Bearer ', '')
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        with db_connection() as conn:
         
-        # Публичный endpoint: проверка доступа по access_token сайта
-        if method == 'GET' and action == 'check-access':
-            access_token = (event.get('queryStringParameters') or {}).get('token', '')
-            return check_access(conn, access_token)
+            # Публичный endpoint: проверка доступа по access_token сайта
+            if method == 'GET' and action == 'check-access':
+                access_token = (event.get('queryStringParameters') or {}).get('token', '')
+                return check_access(conn, access_token)
         
-        # Публичный endpoint: получение реквизитов для оплаты
-        if method == 'GET' and action == 'payment-info':
-            product_id = (event.get('queryStringParameters') or {}).get('product_id', '')
-            return get_payment_info(conn, product_id)
+            # Публичный endpoint: пакетная проверка токенов для нагруженных сайтов продуктов
+            if method == 'POST' and action == 'check-access-batch':
+                return check_access_batch(conn, json.loads(event.get('body') or '{}'))
         
-        # Все остальные endpoints требуют авторизации
-        if not token:
-            conn.close()
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Требуется авторизация'}),
-                'isBase64Encoded': False
-            }
+            # Публичный endpoint: получение реквизитов для оплаты
+            if method == 'GET' and action == 'payment-info':
+                product_id = (event.get('queryStringParameters') or {}).get('product_id', '')
+                return get_payment_info(conn, product_id)
         
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
-            SELECT u.id, u.role, u.email, u.full_name
-            FROM users u
-            JOIN sessions s ON u.id = s.user_id
-            WHERE s.token = %s AND s.expires_at > NOW()
-        """, (token,))
-        user = cursor.fetchone()
-        cursor.close()
+            # Все остальные endpoints требуют авторизации
+            if not token:
+                return json_response(401, {'error': 'Требуется авторизация'})
         
-        if not user:
-            conn.close()
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Сессия истекла, войдите снова'}),
-                'isBase64Encoded': False
-            }
+            user = resolve_session(conn, token)
         
-        if method == 'GET':
-            if action == 'my-orders':
-                return get_my_orders(conn, user['id'])
-            elif action == 'order-detail':
-                order_id = (event.get('queryStringParameters') or {}).get('order_id', '')
-                return get_order_detail(conn, user['id'], order_id)
+            if not user:
+                return json_response(401, {'error': 'Сессия истекла, войдите снова'})
         
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            if action == 'create':
-                return create_order(conn, user['id'], body)
-            elif action == 'confirm-payment':
-                return user_confirm_payment(conn, user['id'], body)
-            elif action == 'renew':
-                return renew_subscription(conn, user['id'], body)
+            if method == 'GET':
+                if action == 'my-orders':
+                    return get_my_orders(conn, user['id'])
+                elif action == 'order-detail':
+                    order_id = (event.get('queryStringParameters') or {}).get('order_id', '')
+                    return get_order_detail(conn, user['id'], order_id)
         
-        conn.close()
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
+            elif method == 'POST':
+                body = json.loads(event.get('body', '{}'))
+                if action == 'create':
+                    return create_order(conn, user['id'], body)
+                elif action == 'confirm-payment':
+                    return user_confirm_payment(conn, user['id'], body)
+                elif action == 'renew':
+                    return renew_subscription(conn, user['id'], body)
+        
+            return json_response(404, {'error': 'Endpoint not found'})
         
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return json_response(500, {'error': str(e)})
 
 
 def get_payment_info(conn, product_id) -> dict:
     """Возвращает информацию о продукте и реквизиты для оплаты"""
     cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    # Готовое тело из снапшота каталога, который перестраивает админка
+    cursor.execute("SELECT body FROM catalog_snapshots WHERE key = %s", (f'payment-info:{product_id}',))
+    snapshot = cursor.fetchone()
+    if snapshot:
+        cursor.close()
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': snapshot['body'],
+            'isBase64Encoded': False
+        }
+    
     cursor.execute("""
         SELECT id, title, description, price, category, image_url, 
                subscription_days, upgrades, is_subscription
@@ -111,110 +605,73 @@ def get_payment_info(conn, product_id) -> dict:
     """, (product_id,))
     product = cursor.fetchone()
     cursor.close()
-    conn.close()
     
     if not product:
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Продукт не найден'}),
-            'isBase64Encoded': False
-        }
+        return json_response(404, {'error': 'Продукт не найден'})
     
     p = dict(product)
     if p.get('upgrades') is None:
         p['upgrades'] = []
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'product': p}, default=str),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'product': p})
 
 
 def create_order(conn, user_id: int, body: dict) -> dict:
     """Создает заказ и возвращает реквизиты для оплаты"""
     product_id = body.get('product_id')
     
+    # Проверка продукта, проверка активной подписки и вставка - одним запросом.
+    # Заказ вставляется, только если продукт найден и активной подписки на него нет
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     cursor.execute("""
-        SELECT id, title, price, subscription_days, website_url, is_subscription
-        FROM products WHERE id = %s AND is_active = TRUE
-    """, (product_id,))
+        WITH product AS (
+            SELECT id, title, price
+            FROM products WHERE id = %(product_id)s AND is_active = TRUE
+        ), active AS (
+            SELECT id FROM orders 
+            WHERE user_id = %(user_id)s AND product_id = %(product_id)s
+              AND subscription_status = 'active' AND expires_at > NOW()
+            LIMIT 1
+        ), created AS (
+            INSERT INTO orders (user_id, product_id, total_amount, status)
+            SELECT %(user_id)s, id, price, 'pending' FROM product
+            WHERE NOT EXISTS (SELECT 1 FROM active)
+            RETURNING id
+        )
+        SELECT p.title, p.price,
+               EXISTS (SELECT 1 FROM active) as has_active,
+               (SELECT id FROM created) as order_id
+        FROM product p
+    """, {'user_id': user_id, 'product_id': product_id})
     product = cursor.fetchone()
+    conn.commit()
+    cursor.close()
     
     if not product:
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Продукт не найден'}),
-            'isBase64Encoded': False
-        }
-    
-    # Проверяем, нет ли уже активного заказа на этот продукт
-    cursor.execute("""
-        SELECT id FROM orders 
-        WHERE user_id = %s AND product_id = %s AND payment_confirmed = TRUE AND expires_at > NOW()
-        LIMIT 1
-    """, (user_id, product_id))
-    existing = cursor.fetchone()
-    if existing:
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'У вас уже есть активная подписка на этот продукт'}),
-            'isBase64Encoded': False
-        }
-    
-    cursor.execute("""
-        INSERT INTO orders (user_id, product_id, total_amount, status)
-        VALUES (%s, %s, %s, 'pending')
-        RETURNING id
-    """, (user_id, product_id, product['price']))
+        return json_response(404, {'error': 'Продукт не найден'})
     
-    order = cursor.fetchone()
-    conn.commit()
-    cursor.close()
-    conn.close()
+    if product['has_active']:
+        return json_response(400, {'error': 'У вас уже есть активная подписка на этот продукт'})
     
-    return {
-        'statusCode': 201,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'message': 'Заказ создан',
-            'order_id': order['id'],
-            'product_title': product['title'],
-            'amount': float(product['price'])
-        }),
-        'isBase64Encoded': False
-    }
+    return json_response(201, {
+        'message': 'Заказ создан',
+        'order_id': product['order_id'],
+        'product_title': product['title'],
+        'amount': float(product['price'])
+    })
 
 
 def get_my_orders(conn, user_id: int) -> dict:
     """Возвращает все заказы пользователя с информацией о подписке"""
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT o.id, o.product_id, o.total_amount, o.status,
                o.paid_at, o.expires_at, o.access_token, o.payment_confirmed,
                o.payment_reference, o.notes, o.created_at,
                p.title as product_title, p.category, p.image_url,
                p.website_url, p.upgrades, p.subscription_days, p.is_subscription,
-               CASE 
-                   WHEN o.payment_confirmed AND o.expires_at > NOW() THEN 'active'
-                   WHEN o.payment_confirmed AND o.expires_at <= NOW() THEN 'expired'
-                   WHEN o.payment_confirmed AND o.expires_at IS NULL THEN 'active'
-                   ELSE 'pending'
-               END as subscription_status,
-               CASE 
-                   WHEN o.expires_at IS NOT NULL THEN 
-                       EXTRACT(DAY FROM (o.expires_at - NOW()))::INTEGER
-                   ELSE NULL
-               END as days_left
+               {SUBSCRIPTION_STATUS_SQL} as subscription_status,
+               EXTRACT(DAY FROM (o.expires_at - NOW()))::INTEGER as days_left
         FROM orders o
         JOIN products p ON o.product_id = p.id
         WHERE o.user_id = %s
@@ -222,7 +679,6 @@ def get_my_orders(conn, user_id: int) -> dict:
     """, (user_id,))
     orders = cursor.fetchall()
     cursor.close()
-    conn.close()
     
     result = []
     for o in orders:
@@ -231,45 +687,31 @@ def get_my_orders(conn, user_id: int) -> dict:
             d['upgrades'] = []
         result.append(d)
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'orders': result}, default=str),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'orders': result})
 
 
 def get_order_detail(conn, user_id: int, order_id) -> dict:
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
+    # subscription_status после o.* заменяет сохранённое значение с учётом ещё не обработанного sweeper'ом срока
+    cursor.execute(f"""
         SELECT o.*, p.title as product_title, p.website_url, p.upgrades,
-               p.subscription_days, p.is_subscription, p.image_url
+               p.subscription_days, p.is_subscription, p.image_url,
+               {SUBSCRIPTION_STATUS_SQL} as subscription_status
         FROM orders o
         JOIN products p ON o.product_id = p.id
         WHERE o.id = %s AND o.user_id = %s
     """, (order_id, user_id))
     order = cursor.fetchone()
     cursor.close()
-    conn.close()
     
     if not order:
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Заказ не найден'}),
-            'isBase64Encoded': False
-        }
+        return json_response(404, {'error': 'Заказ не найден'})
     
     d = dict(order)
     if d.get('upgrades') is None:
         d['upgrades'] = []
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'order': d}, default=str),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {'order': d})
 
 
 def user_confirm_payment(conn, user_id: int, body: dict) -> dict:
@@ -279,131 +721,209 @@ def user_confirm_payment(conn, user_id: int, body: dict) -> dict:
     order_id = body.get('order_id')
     
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
-        SELECT o.*, p.website_url, p.title as product_title
+    cursor.execute(f"""
+        SELECT o.access_token, o.expires_at, p.website_url,
+               {SUBSCRIPTION_STATUS_SQL} as subscription_status
         FROM orders o
         JOIN products p ON o.product_id = p.id
         WHERE o.id = %s AND o.user_id = %s
     """, (order_id, user_id))
     order = cursor.fetchone()
-    
-    if not order:
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Заказ не найден'}),
-            'isBase64Encoded': False
-        }
-    
-    if not order['payment_confirmed']:
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 402,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'error': 'Оплата ещё не подтверждена. Пожалуйста, подождите подтверждения от менеджера.',
-                'status': 'waiting_confirmation'
-            }),
-            'isBase64Encoded': False
-        }
-    
-    if order['expires_at']:
-        from datetime import datetime
-        if order['expires_at'] < datetime.now():
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'error': 'Подписка истекла. Пожалуйста, продлите подписку.',
-                    'status': 'expired'
-                }),
-                'isBase64Encoded': False
-            }
-    
     cursor.close()
-    conn.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'message': 'Оплата подтверждена, доступ разрешен',
-            'access_token': order['access_token'],
-            'expires_at': str(order['expires_at']) if order['expires_at'] else None,
-            'website_url': order['website_url'],
-            'status': 'granted'
-        }),
-        'isBase64Encoded': False
-    }
+    if not order:
+        return json_response(404, {'error': 'Заказ не найден'})
+    
+    if order['subscription_status'] == 'pending':
+        return json_response(402, {
+            'error': 'Оплата ещё не подтверждена. Пожалуйста, подождите подтверждения от менеджера.',
+            'status': 'waiting_confirmation'
+        })
+    
+    if order['subscription_status'] == 'expired':
+        return json_response(403, {
+            'error': 'Подписка истекла. Пожалуйста, продлите подписку.',
+            'status': 'expired'
+        })
+    
+    return json_response(200, {
+        'message': 'Оплата подтверждена, доступ разрешен',
+        'access_token': order['access_token'],
+        'expires_at': str(order['expires_at']) if order['expires_at'] else None,
+        'website_url': order['website_url'],
+        'status': 'granted'
+    })
 
 
 def check_access(conn, access_token: str) -> dict:
     """Проверяет токен доступа - используется сайтом продукта для верификации входа"""
     if not access_token:
-        conn.close()
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Токен не указан', 'access': False}),
-            'isBase64Encoded': False
-        }
+        return json_response(400, {'error': 'Токен не указан', 'access': False})
+    
+    return json_response(*resolve_access(conn, [access_token])[access_token])
+
+
+def check_access_batch(conn, body: dict) -> dict:
+    """Пакетная проверка токенов доступа для сайтов продуктов. Результаты - в порядке запроса."""
+    tokens = body.get('tokens') if isinstance(body, dict) else None
+    if not isinstance(tokens, list) or not tokens or len(tokens) > CHECK_ACCESS_BATCH_MAX \
+            or not all(isinstance(t, str) for t in tokens):
+        return json_response(400, {'error': f'Передайте от 1 до {CHECK_ACCESS_BATCH_MAX} токенов в tokens', 'access': False})
+    
+    results = resolve_access(conn, [t for t in tokens if t])
+    results[''] = (400, {'error': 'Токен не указан', 'access': False})
+    
+    return json_response(200, {
+        'results': [
+            {'token': t, 'status': results[t][0], **results[t][1]} for t in tokens
+        ]
+    })
+
+
+def resolve_access(conn, tokens: list) -> dict:
+    """token -> (HTTP-статус, тело) для непустых токенов. Подписанные токены проверяются в процессе,
+    остальные берутся из кэша результатов или одним запросом WHERE access_token = ANY(...)."""
+    sync_access_cache(conn)
+    
+    results = {}
+    pending = []
+    for access_token in dict.fromkeys(tokens):
+        claims = decode_access_token(access_token)
+        if claims is not None:
+            results[access_token] = evaluate_signed_access(conn, claims)
+            continue
+        cached = _access_cache.get(access_token)
+        if cached is not None:
+            results[access_token] = cached
+        else:
+            pending.append(access_token)
+    
+    if not pending:
+        return results
     
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
-        SELECT o.id, o.expires_at, o.payment_confirmed, o.user_id,
+    cursor.execute(f"""
+        SELECT o.access_token, o.id, o.expires_at, o.user_id,
+               {SUBSCRIPTION_STATUS_SQL} as subscription_status,
                u.email, u.full_name,
                p.title as product_title, p.website_url
         FROM orders o
         JOIN users u ON o.user_id = u.id
         JOIN products p ON o.product_id = p.id
-        WHERE o.access_token = %s
-    """, (access_token,))
-    order = cursor.fetchone()
+        WHERE o.access_token = ANY(%s)
+    """, (pending,))
+    orders = {order['access_token']: order for order in cursor.fetchall()}
     cursor.close()
-    conn.close()
     
+    for access_token in pending:
+        order = orders.get(access_token)
+        result = evaluate_order_access(order)
+        _access_cache.put(access_token, result, access_result_ttl(result, order))
+        results[access_token] = result
+    return results
+
+
+def access_result_ttl(result: tuple, order) -> float:
+    """Положительный ответ живёт не дольше expires_at подписки; отказ по неизвестному токену
+    или неподтверждённой оплате - ACCESS_CACHE_NEGATIVE_TTL, чтобы перебор токенов не нагружал БД"""
+    status, payload = result
+    if status == 200:
+        if order['expires_at']:
+            return min(ACCESS_CACHE_TTL, (order['expires_at'] - datetime.now()).total_seconds())
+        return ACCESS_CACHE_TTL
+    if payload.get('expired'):
+        return ACCESS_CACHE_TTL
+    return ACCESS_CACHE_NEGATIVE_TTL
+
+
+def sync_access_cache(conn) -> None:
+    """Сбрасывает кэш результатов, если админка изменила заказы (счётчик cache_generations.access).
+    Счётчик читается не чаще раза в ACCESS_CACHE_SYNC_INTERVAL секунд."""
+    global _access_generation
+    generation, checked_at = _access_generation
+    if time.monotonic() - checked_at < ACCESS_CACHE_SYNC_INTERVAL:
+        return
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT generation FROM cache_generations WHERE name = 'access'")
+    row = cursor.fetchone()
+    cursor.close()
+    
+    current = row[0] if row else 0
+    if current != generation:
+        _access_cache.clear()
+    _access_generation = (current, time.monotonic())
+
+
+def evaluate_order_access(order) -> tuple:
+    """(HTTP-статус, тело) проверки доступа по строке заказа; None - токен не найден"""
     if not order:
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Токен недействителен', 'access': False}),
-            'isBase64Encoded': False
-        }
+        return 404, {'error': 'Токен недействителен', 'access': False}
     
-    if not order['payment_confirmed']:
-        return {
-            'statusCode': 403,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Оплата не подтверждена', 'access': False}),
-            'isBase64Encoded': False
-        }
+    if order['subscription_status'] == 'pending':
+        return 403, {'error': 'Оплата не подтверждена', 'access': False}
     
-    if order['expires_at']:
-        from datetime import datetime
-        if order['expires_at'] < datetime.now():
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Подписка истекла', 'access': False, 'expired': True}),
-                'isBase64Encoded': False
-            }
+    if order['subscription_status'] == 'expired':
+        return 403, {'error': 'Подписка истекла', 'access': False, 'expired': True}
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'access': True,
-            'user_email': order['email'],
-            'user_name': order['full_name'],
-            'product_title': order['product_title'],
-            'expires_at': str(order['expires_at']) if order['expires_at'] else None
-        }),
-        'isBase64Encoded': False
+    return 200, {
+        'access': True,
+        'user_email': order['email'],
+        'user_name': order['full_name'],
+        'product_title': order['product_title'],
+        'expires_at': str(order['expires_at']) if order['expires_at'] else None
+    }
+
+
+def decode_access_token(access_token: str):
+    """Возвращает claims подписанного токена v1.<payload>.<hmac>; None, если токен не подписан
+    или подпись не сходится (такие токены проверяются по БД как обычные)"""
+    if not ACCESS_TOKEN_SECRET or not access_token.startswith('v1.'):
+        return None
+    parts = access_token.split('.')
+    if len(parts) != 3:
+        return None
+    
+    payload, signature = parts[1], parts[2]
+    expected = hmac.new(ACCESS_TOKEN_SECRET.encode('utf-8'), payload.encode('ascii', 'replace'), hashlib.sha256).digest()
+    if not hmac.compare_digest(base64.urlsafe_b64encode(expected).rstrip(b'=').decode('ascii'), signature):
+        return None
+    return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+
+
+def get_revoked_orders(conn) -> dict:
+    """order_id -> время отзыва из revoked_access_tokens; список небольшой и кэшируется на ACCESS_REVOCATION_TTL"""
+    global _revoked_orders
+    cached = _revoked_orders
+    if cached and time.monotonic() - cached[1] < ACCESS_REVOCATION_TTL:
+        return cached[0]
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT order_id, revoked_at FROM revoked_access_tokens")
+    revoked = dict(cursor.fetchall())
+    cursor.close()
+    
+    _revoked_orders = (revoked, time.monotonic())
+    return revoked
+
+
+def evaluate_signed_access(conn, claims: dict) -> tuple:
+    """(HTTP-статус, тело) проверки подписанного токена: только список отзыва и срок действия.
+    Отозваны токены, выданные строго раньше revoked_at: токен, выданный в той же транзакции,
+    что и отзыв (повторное подтверждение оплаты), остаётся действительным."""
+    revoked_at = get_revoked_orders(conn).get(claims['order_id'])
+    if revoked_at and datetime.fromisoformat(claims['issued_at']) < revoked_at:
+        return 403, {'error': 'Доступ отозван', 'access': False}
+    
+    if datetime.fromisoformat(claims['expires_at']) < datetime.now():
+        return 403, {'error': 'Подписка истекла', 'access': False, 'expired': True}
+    
+    return 200, {
+        'access': True,
+        'user_email': claims['user_email'],
+        'user_name': claims['user_name'],
+        'product_title': claims['product_title'],
+        'expires_at': claims['expires_at']
     }
 
 
@@ -411,43 +931,25 @@ def renew_subscription(conn, user_id: int, body: dict) -> dict:
     """Создает новый заказ для продления подписки"""
     order_id = body.get('order_id')
     
+    # Новый заказ по текущей цене продукта из исходного заказа; нет исходного заказа - нет вставки
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     cursor.execute("""
-        SELECT o.product_id, p.title, p.price
+        INSERT INTO orders (user_id, product_id, total_amount, status, notes)
+        SELECT o.user_id, o.product_id, p.price, 'pending', 'Продление подписки'
         FROM orders o
         JOIN products p ON o.product_id = p.id
         WHERE o.id = %s AND o.user_id = %s
+        RETURNING id, total_amount
     """, (order_id, user_id))
-    old_order = cursor.fetchone()
-    
-    if not old_order:
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Заказ не найден'}),
-            'isBase64Encoded': False
-        }
-    
-    cursor.execute("""
-        INSERT INTO orders (user_id, product_id, total_amount, status, notes)
-        VALUES (%s, %s, %s, 'pending', 'Продление подписки')
-        RETURNING id
-    """, (user_id, old_order['product_id'], old_order['price']))
-    
     new_order = cursor.fetchone()
     conn.commit()
     cursor.close()
-    conn.close()
     
-    return {
-        'statusCode': 201,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'message': 'Заказ на продление создан',
-            'order_id': new_order['id'],
-            'amount': float(old_order['price'])
-        }),
-        'isBase64Encoded': False
-    }
+    if not new_order:
+        return json_response(404, {'error': 'Заказ не найден'})
+    
+    return json_response(201, {
+        'message': 'Заказ на продление создан',
+        'order_id': new_order['id'],
+        'amount': float(new_order['total_amount'])
+    })
@@ -1,8 +1,454 @@
+import hashlib
 import json
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from datetime import date
+from decimal import Decimal
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
 from psycopg2.extras import RealDictCursor
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '1') != '0'
+
+# Фазы текущего запроса: имя -> секунды. Поток на запрос, поэтому thread-local.
+_timing = threading.local()
+
+
+@contextmanager
+def timed(phase: str):
+    """Добавляет длительность блока к фазе текущего запроса (Server-Timing и лог запроса).
+    Фазы не пересекаются: запросы к БД внутри фазы считаются в неё, а не в db."""
+    phases = getattr(_timing, 'phases', None)
+    if phases is None or _timing.phase is not None:
+        yield
+        return
+    _timing.phase = phase
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - started
+        _timing.phase = None
+
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_SAMPLE = float(os.environ.get('SLOW_QUERY_SAMPLE', '0.1'))
+SLOW_QUERY_COOLDOWN = float(os.environ.get('SLOW_QUERY_COOLDOWN', '300'))
+
+# Когда последний раз снимали план для текста запроса - не чаще раза в SLOW_QUERY_COOLDOWN
+_explained = {}
+_explained_lock = threading.Lock()
+
+
+def param_shape(vars):
+    """Типы параметров без значений - чтобы в лог не попадали токены и персональные данные"""
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {key: type(value).__name__ for key, value in vars.items()}
+    return [type(value).__name__ for value in vars]
+
+
+def should_explain(text: str) -> bool:
+    if random.random() >= SLOW_QUERY_SAMPLE:
+        return False
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(text, -SLOW_QUERY_COOLDOWN) < SLOW_QUERY_COOLDOWN:
+            return False
+        _explained[text] = now
+        if len(_explained) > 1000:
+            _explained.clear()
+    return True
+
+
+EXPLAINABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def is_explainable(query: str) -> bool:
+    """Одиночный SELECT/INSERT/UPDATE/DELETE/WITH. В тексте из нескольких команд EXPLAIN покрыл бы
+    только первую, а остальные выполнились бы второй раз по-настоящему - такие запросы не трогаем."""
+    text = query.strip().rstrip(';')
+    if ';' in text:
+        return False
+    words = text.split(None, 1)
+    return bool(words) and words[0].upper() in EXPLAINABLE_STATEMENTS
+
+
+def explain_query(conn, query, vars) -> str:
+    """План медленного запроса. ANALYZE только для SELECT: запись нельзя выполнять второй раз,
+    для неё - обычный EXPLAIN. В открытой транзакции план снимается под savepoint,
+    чтобы ошибка EXPLAIN её не сломала."""
+    analyze = query.lstrip().upper().startswith('SELECT')
+    prefix = 'EXPLAIN (ANALYZE, BUFFERS)' if analyze else 'EXPLAIN'
+    in_transaction = not conn.autocommit and conn.info.transaction_status != TRANSACTION_STATUS_IDLE
+    cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        if in_transaction:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(f'{prefix} {query}', vars)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        except psycopg2.Error as e:
+            plan = f'EXPLAIN не удался: {e}'
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+        if in_transaction:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+    finally:
+        cursor.close()
+    return plan
+
+
+def log_slow_query(conn, query, vars, elapsed: float) -> None:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = query.as_string(conn)
+    text = ' '.join(query.split())
+    entry = {
+        'event': 'slow_query',
+        'duration_ms': round(elapsed * 1000, 1),
+        'query': text[:2000],
+        'params': param_shape(vars)
+    }
+    if is_explainable(query) and should_explain(text):
+        entry['plan'] = explain_query(conn, query, vars)
+    print(json.dumps(entry, ensure_ascii=False))
+
+
+class TimedCursorMixin:
+    """Время каждого запроса к БД идёт в фазу db, число запросов и прочитанных строк - в лог запроса.
+    Запросы дольше SLOW_QUERY_MS пишутся в лог медленных запросов."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        with timed('db'):
+            result = super().execute(query, vars)
+        elapsed = time.perf_counter() - started
+        if getattr(_timing, 'phases', None) is not None:
+            _timing.queries += 1
+            if self.description is not None:
+                _timing.rows += max(self.rowcount, 0)
+        # Для именованных курсоров execute - только DECLARE, строки читаются позже
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS and not self.name:
+            log_slow_query(self.connection, query, vars, elapsed)
+        return result
+
+
+class TimedCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or TimedCursor
+        kwargs['cursor_factory'] = TimedRealDictCursor if factory is RealDictCursor else factory
+        return super().cursor(*args, **kwargs)
+
+
+def timed_handler(function: str):
+    """Замеряет фазы запроса: пишет JSON-строку в лог и добавляет заголовок Server-Timing"""
+    def decorate(handler):
+        @wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            if not REQUEST_TIMING:
+                return handler(event, context)
+            _timing.phases = {}
+            _timing.phase = None
+            _timing.rows = 0
+            _timing.queries = 0
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+                total = time.perf_counter() - started
+                phases, rows, queries = _timing.phases, _timing.rows, _timing.queries
+            finally:
+                _timing.phases = None
+            
+            # app - всё, что не попало в фазы: логика обработчика и чтение строк
+            phases['app'] = max(total - sum(phases.values()), 0.0)
+            metrics = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in phases.items()]
+            metrics.append(f'total;dur={total * 1000:.1f}')
+            metrics.append(f'queries;desc="{queries}"')
+            print(json.dumps({
+                'event': 'request',
+                'function': function,
+                'method': event.get('httpMethod'),
+                'action': (event.get('queryStringParameters') or {}).get('action', ''),
+                'status': response.get('statusCode'),
+                'duration_ms': round(total * 1000, 1),
+                'phases': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+                'rows': rows,
+                'queries': queries
+            }))
+            return {
+                **response,
+                'headers': {
+                    **(response.get('headers') or {}),
+                    'Server-Timing': ', '.join(metrics),
+                    'Timing-Allow-Origin': '*'
+                }
+            }
+        return wrapper
+    return decorate
+
+
+# Общие заголовки JSON-ответов. Один экземпляр на все ответы - не изменять на месте,
+# дополнительные заголовки передаются в json_response и сливаются в новый словарь.
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def json_default(value):
+    """Типы из psycopg2, которых не знает json: NUMERIC -> число, даты -> ISO 8601"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Тип {type(value).__name__} не сериализуется в JSON')
+
+
+_json_encoder = json.JSONEncoder(default=json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(data) -> str:
+    """Сериализация тела ответа: orjson, если установлен, иначе стандартный json с тем же результатом"""
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return _json_encoder.encode(data)
+
+
+def json_response(status: int, data, headers: dict = None) -> dict:
+    with timed('serialize'):
+        body = dumps(data)
+    return {
+        'statusCode': status,
+        'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+
+class ConnectionPool:
+    """Пул соединений с БД уровня модуля - живёт между вызовами в тёплом инстансе функции.
+    Ограничивает число соединений, проверяет простаивавшие соединения перед выдачей
+    и сбрасывает (rollback/закрытие) соединения при возврате."""
+
+    def __init__(self, dsn: str, maxconn: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def getconn(self, timeout: float = None):
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise PoolError('Пул соединений с БД исчерпан')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+                conn, released_at = item
+                if self._is_healthy(conn, released_at):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if self._reset(conn):
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reset(self, conn) -> bool:
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status == TRANSACTION_STATUS_IDLE:
+            return True
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'], DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Выдаёт соединение из пула и всегда возвращает его обратно, даже при исключении"""
+    pool = get_pool()
+    with timed('connect'):
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', '5'))
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', '30'))
+CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', '64'))
+
+_catalog_version = None
+_catalog_responses = OrderedDict()
+_snapshots = OrderedDict()
+_catalog_lock = threading.Lock()
+
+
+def get_catalog_version(conn) -> str:
+    """Версия каталога по COUNT(*) и MAX(updated_at); кэшируется на CATALOG_VERSION_TTL секунд"""
+    global _catalog_version
+    cached = _catalog_version
+    if cached and time.monotonic() - cached[1] < CATALOG_VERSION_TTL:
+        return cached[0]
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), MAX(updated_at) FROM products")
+    total, updated_at = cursor.fetchone()
+    cursor.close()
+    
+    version = hashlib.sha1(f'{total}:{updated_at}'.encode('utf-8')).hexdigest()[:16]
+    _catalog_version = (version, time.monotonic())
+    return version
+
+
+def get_snapshot(conn, key: str):
+    """Готовое тело ответа из catalog_snapshots (одно чтение по первичному ключу).
+    Результат держится в памяти процесса CATALOG_VERSION_TTL секунд."""
+    with _catalog_lock:
+        cached = _snapshots.get(key)
+    if cached and time.monotonic() - cached[2] < CATALOG_VERSION_TTL:
+        return cached[0], cached[1]
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT version, body FROM catalog_snapshots WHERE key = %s", (key,))
+    row = cursor.fetchone()
+    cursor.close()
+    
+    if not row:
+        return None
+    
+    with _catalog_lock:
+        _snapshots[key] = (row[0], row[1], time.monotonic())
+        _snapshots.move_to_end(key)
+        while len(_snapshots) > CATALOG_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+    return row[0], row[1]
+
+
+def etag_matches(event: dict, etag: str) -> bool:
+    headers = event.get('headers') or {}
+    value = headers.get('if-none-match', '') or headers.get('If-None-Match', '')
+    if not value:
+        return False
+    if value.strip() == '*':
+        return True
+    candidates = [v.strip() for v in value.split(',')]
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+def get_cached_response(etag: str):
+    with _catalog_lock:
+        response = _catalog_responses.get(etag)
+        if response is not None:
+            _catalog_responses.move_to_end(etag)
+        return response
+
+
+def put_cached_response(etag: str, response: dict) -> None:
+    with _catalog_lock:
+        _catalog_responses[etag] = response
+        _catalog_responses.move_to_end(etag)
+        while len(_catalog_responses) > CATALOG_CACHE_SIZE:
+            _catalog_responses.popitem(last=False)
+
+
+def not_modified_response(etag: str) -> dict:
+    return with_cache_headers({
+        'statusCode': 304,
+        'headers': {'Access-Control-Allow-Origin': '*'},
+        'body': '',
+        'isBase64Encoded': False
+    }, etag)
+
+
+def with_cache_headers(response: dict, etag: str) -> dict:
+    return {
+        **response,
+        'headers': {
+            **response['headers'],
+            'ETag': etag,
+            'Cache-Control': f'public, max-age={CATALOG_MAX_AGE}',
+            'Access-Control-Expose-Headers': 'ETag'
+        }
+    }
+
+
+@timed_handler('products')
 def handler(event: dict, context) -> dict:
     """API для работы с продуктами магазина - получение списка и деталей товаров"""
     method = event.get('httpMethod', 'GET')
@@ -13,7 +459,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -21,31 +467,54 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        with db_connection() as conn:
         
-        if method == 'GET':
-            product_id = event.get('queryStringParameters', {}).get('id')
+            if method == 'GET':
+                product_id = event.get('queryStringParameters', {}).get('id') or None
+                if product_id is not None:
+                    # id попадает в ключ снапшота и в ETag - только целое число
+                    try:
+                        product_id = int(product_id)
+                    except ValueError:
+                        return json_response(400, {'error': 'Некорректный id продукта'})
             
-            if product_id:
-                return get_product_detail(conn, product_id)
-            else:
-                return get_products_list(conn)
+                # Снапшот каталога, который перестраивает админка: тело отдаётся как есть
+                snapshot = get_snapshot(conn, f'product:{product_id}' if product_id is not None else 'list')
+                if snapshot:
+                    etag = f'"{snapshot[0]}"'
+                    if etag_matches(event, etag):
+                        return not_modified_response(etag)
+                    return with_cache_headers({
+                        'statusCode': 200,
+                        'headers': JSON_HEADERS,
+                        'body': snapshot[1],
+                        'isBase64Encoded': False
+                    }, etag)
+            
+                # Снапшота ещё нет - считаем каталог из products
+                version = get_catalog_version(conn)
+                etag = f'"{version}-{product_id}"' if product_id is not None else f'"{version}"'
+            
+                # Клиент уже имеет актуальную версию каталога - строки не читаем и не сериализуем
+                if etag_matches(event, etag):
+                    return not_modified_response(etag)
+            
+                response = get_cached_response(etag)
+                if response is None:
+                    if product_id is not None:
+                        response = get_product_detail(conn, product_id)
+                    else:
+                        response = get_products_list(conn)
+                    if response['statusCode'] != 200:
+                        return response
+                    put_cached_response(etag, response)
+            
+                return with_cache_headers(response, etag)
         
-        conn.close()
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+            return json_response(405, {'error': 'Method not allowed'})
         
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return json_response(500, {'error': str(e)})
 
 
 def get_products_list(conn) -> dict:
@@ -60,19 +529,13 @@ def get_products_list(conn) -> dict:
     
     products = cursor.fetchall()
     cursor.close()
-    conn.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'products': [dict(p) for p in products]
-        }, default=str),
-        'isBase64Encoded': False
-    }
+    return json_response(200, {
+        'products': [dict(p) for p in products]
+    })
 
 
-def get_product_detail(conn, product_id: str) -> dict:
+def get_product_detail(conn, product_id: int) -> dict:
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     cursor.execute("""
@@ -83,19 +546,8 @@ def get_product_detail(conn, product_id: str) -> dict:
     
     product = cursor.fetchone()
     cursor.close()
-    conn.close()
     
     if not product:
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Продукт не найден'}),
-            'isBase64Encoded': False
-        }
+        return json_response(404, {'error': 'Продукт не найден'})
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'product': dict(product)}, default=str),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    return json_response(200, {'product': dict(product)})
\ No newline at end of file
@@ -0,0 +1,9 @@
+-- Снапшот витрины: готовые JSON-тела ответов каталога, перестраиваются админкой при записи продуктов
+-- Ключи: 'list' - список активных продуктов, 'product:<id>' - карточка продукта,
+-- 'payment-info:<id>' - продукт с реквизитами для оплаты
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.catalog_snapshots (
+    key VARCHAR(100) PRIMARY KEY,
+    version VARCHAR(64) NOT NULL,
+    body TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,8 @@
+-- Индексы для постраничной выдачи (keyset по created_at, id) и фильтров админ-панели
+CREATE INDEX IF NOT EXISTS idx_orders_created_id ON t_p13776910_data_analytics_solut.orders(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_id ON t_p13776910_data_analytics_solut.orders(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_confirmed_created_id ON t_p13776910_data_analytics_solut.orders(payment_confirmed, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_product_created_id ON t_p13776910_data_analytics_solut.orders(product_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_created_id ON t_p13776910_data_analytics_solut.users(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_role_created_id ON t_p13776910_data_analytics_solut.users(role, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_created_id ON t_p13776910_data_analytics_solut.products(created_at DESC, id DESC);
@@ -0,0 +1,97 @@
+-- Сводная статистика дашборда в одной строке, поддерживается триггерами на users, products и orders
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.dashboard_stats (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    users_count BIGINT NOT NULL DEFAULT 0,
+    products_count BIGINT NOT NULL DEFAULT 0,
+    orders_count BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p13776910_data_analytics_solut.dashboard_stats (id, users_count, products_count, orders_count, revenue)
+SELECT 1,
+       (SELECT COUNT(*) FROM t_p13776910_data_analytics_solut.users),
+       (SELECT COUNT(*) FROM t_p13776910_data_analytics_solut.products WHERE is_active = TRUE),
+       COUNT(*),
+       COALESCE(SUM(total_amount) FILTER (WHERE status = 'paid' OR payment_confirmed = TRUE), 0)
+FROM t_p13776910_data_analytics_solut.orders
+ON CONFLICT (id) DO NOTHING;
+
+-- Пользователи: +1 при вставке, -1 при удалении
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_users() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p13776910_data_analytics_solut.dashboard_stats
+    SET users_count = users_count + CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END,
+        updated_at = NOW()
+    WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Продукты: учитываются только активные, поэтому смотрим is_active до и после изменения
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_products() RETURNS TRIGGER AS $$
+DECLARE
+    delta INTEGER := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_active THEN
+        delta := delta + 1;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_active THEN
+        delta := delta - 1;
+    END IF;
+    IF delta <> 0 THEN
+        UPDATE t_p13776910_data_analytics_solut.dashboard_stats
+        SET products_count = products_count + delta, updated_at = NOW()
+        WHERE id = 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заказы: количество и выручка (status = 'paid' или подтверждённая оплата)
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_orders() RETURNS TRIGGER AS $$
+DECLARE
+    count_delta INTEGER := 0;
+    revenue_delta DECIMAL(14, 2) := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_OP = 'INSERT' THEN
+            count_delta := count_delta + 1;
+        END IF;
+        IF NEW.status = 'paid' OR NEW.payment_confirmed THEN
+            revenue_delta := revenue_delta + NEW.total_amount;
+        END IF;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF TG_OP = 'DELETE' THEN
+            count_delta := count_delta - 1;
+        END IF;
+        IF OLD.status = 'paid' OR OLD.payment_confirmed THEN
+            revenue_delta := revenue_delta - OLD.total_amount;
+        END IF;
+    END IF;
+    IF count_delta <> 0 OR revenue_delta <> 0 THEN
+        UPDATE t_p13776910_data_analytics_solut.dashboard_stats
+        SET orders_count = orders_count + count_delta,
+            revenue = revenue + revenue_delta,
+            updated_at = NOW()
+        WHERE id = 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_dashboard_stats_users ON t_p13776910_data_analytics_solut.users;
+CREATE TRIGGER trg_dashboard_stats_users
+    AFTER INSERT OR DELETE ON t_p13776910_data_analytics_solut.users
+    FOR EACH ROW EXECUTE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_users();
+
+DROP TRIGGER IF EXISTS trg_dashboard_stats_products ON t_p13776910_data_analytics_solut.products;
+CREATE TRIGGER trg_dashboard_stats_products
+    AFTER INSERT OR UPDATE OF is_active OR DELETE ON t_p13776910_data_analytics_solut.products
+    FOR EACH ROW EXECUTE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_products();
+
+DROP TRIGGER IF EXISTS trg_dashboard_stats_orders ON t_p13776910_data_analytics_solut.orders;
+CREATE TRIGGER trg_dashboard_stats_orders
+    AFTER INSERT OR UPDATE OF status, payment_confirmed, total_amount OR DELETE ON t_p13776910_data_analytics_solut.orders
+    FOR EACH ROW EXECUTE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_orders();
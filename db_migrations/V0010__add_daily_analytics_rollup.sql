@@ -0,0 +1,46 @@
+-- Дневные агрегаты для аналитики: заказы по дням создания, оплаты и выручка по дням подтверждения
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.daily_order_stats (
+    day DATE NOT NULL,
+    product_id INTEGER NOT NULL,
+    new_orders INTEGER NOT NULL DEFAULT 0,
+    confirmed_payments INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, product_id)
+);
+
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.daily_user_stats (
+    day DATE PRIMARY KEY,
+    new_users INTEGER NOT NULL DEFAULT 0
+);
+
+-- Все дни раньше rolled_up_to уже посчитаны и не меняются; текущий день считается на лету
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.analytics_rollup_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    rolled_up_to DATE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_paid_at ON t_p13776910_data_analytics_solut.orders(paid_at);
+
+-- Первичное заполнение всех завершённых дней
+INSERT INTO t_p13776910_data_analytics_solut.daily_order_stats (day, product_id, new_orders, confirmed_payments, revenue)
+SELECT day, product_id, SUM(new_orders), SUM(confirmed_payments), SUM(revenue)
+FROM (
+    SELECT created_at::date AS day, COALESCE(product_id, 0) AS product_id,
+           1 AS new_orders, 0 AS confirmed_payments, 0 AS revenue
+    FROM t_p13776910_data_analytics_solut.orders WHERE created_at < CURRENT_DATE
+    UNION ALL
+    SELECT paid_at::date, COALESCE(product_id, 0), 0, 1, total_amount
+    FROM t_p13776910_data_analytics_solut.orders WHERE payment_confirmed = TRUE AND paid_at < CURRENT_DATE
+) d
+GROUP BY day, product_id
+ON CONFLICT (day, product_id) DO NOTHING;
+
+INSERT INTO t_p13776910_data_analytics_solut.daily_user_stats (day, new_users)
+SELECT created_at::date, COUNT(*)
+FROM t_p13776910_data_analytics_solut.users WHERE created_at < CURRENT_DATE
+GROUP BY created_at::date
+ON CONFLICT (day) DO NOTHING;
+
+INSERT INTO t_p13776910_data_analytics_solut.analytics_rollup_state (id, rolled_up_to)
+VALUES (1, CURRENT_DATE)
+ON CONFLICT (id) DO NOTHING;
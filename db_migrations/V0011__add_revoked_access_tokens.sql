@@ -0,0 +1,5 @@
+-- Список отзыва подписанных токенов доступа: токены заказа, выданные не позже revoked_at, недействительны
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.revoked_access_tokens (
+    order_id INTEGER PRIMARY KEY REFERENCES t_p13776910_data_analytics_solut.orders(id),
+    revoked_at TIMESTAMP NOT NULL
+);
@@ -0,0 +1,9 @@
+-- Счётчики поколений для сброса in-process кэшей в других функциях (orders кэширует результаты check_access)
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.cache_generations (
+    name VARCHAR(50) PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO t_p13776910_data_analytics_solut.cache_generations (name, generation)
+VALUES ('access', 0)
+ON CONFLICT (name) DO NOTHING;
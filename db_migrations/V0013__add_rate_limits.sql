@@ -0,0 +1,8 @@
+-- Общее состояние token bucket для ограничения попыток входа и регистрации (ключ: action:email:... / action:ip:...)
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.rate_limits (
+    key VARCHAR(400) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limits_updated_at ON t_p13776910_data_analytics_solut.rate_limits(updated_at);
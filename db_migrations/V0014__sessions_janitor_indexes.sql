@@ -0,0 +1,9 @@
+-- idx_sessions_token дублирует индекс ограничения UNIQUE(token) и только удваивает стоимость записи
+DROP INDEX IF EXISTS t_p13776910_data_analytics_solut.idx_sessions_token;
+
+-- Поиск истёкших сессий для пакетной очистки
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON t_p13776910_data_analytics_solut.sessions(expires_at);
+
+-- Ограничение числа живых сессий пользователя: самые новые сессии пользователя
+CREATE INDEX IF NOT EXISTS idx_sessions_user_created ON t_p13776910_data_analytics_solut.sessions(user_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS t_p13776910_data_analytics_solut.idx_sessions_user_id;
@@ -0,0 +1,9 @@
+-- Безопасное приведение текста к JSONB для пакетной загрузки каталога: NULL вместо ошибки,
+-- чтобы проверить upgrades всех строк одним запросом и вернуть номера ошибочных строк
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.try_jsonb(value TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
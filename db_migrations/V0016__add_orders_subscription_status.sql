@@ -0,0 +1,35 @@
+-- Сохранённый статус подписки заказа: pending (оплата не подтверждена), active, expired.
+-- Триггер выставляет его при вставке и при изменении оплаты или срока, переход active -> expired
+-- по времени делает пакетный sweeper (admin expire-subscriptions)
+ALTER TABLE t_p13776910_data_analytics_solut.orders
+  ADD COLUMN IF NOT EXISTS subscription_status VARCHAR(20) NOT NULL DEFAULT 'pending'
+    CHECK (subscription_status IN ('pending', 'active', 'expired'));
+
+UPDATE t_p13776910_data_analytics_solut.orders
+SET subscription_status = CASE
+    WHEN expires_at IS NULL OR expires_at > NOW() THEN 'active'
+    ELSE 'expired'
+END
+WHERE payment_confirmed = TRUE;
+
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.orders_subscription_status() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.subscription_status := CASE
+        WHEN NOT COALESCE(NEW.payment_confirmed, FALSE) THEN 'pending'
+        WHEN NEW.expires_at IS NULL OR NEW.expires_at > NOW() THEN 'active'
+        ELSE 'expired'
+    END;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_subscription_status ON t_p13776910_data_analytics_solut.orders;
+CREATE TRIGGER trg_orders_subscription_status
+    BEFORE INSERT OR UPDATE OF payment_confirmed, expires_at ON t_p13776910_data_analytics_solut.orders
+    FOR EACH ROW EXECUTE FUNCTION t_p13776910_data_analytics_solut.orders_subscription_status();
+
+-- idx_orders_expires_at нужен только активным подпискам (sweeper и счётчик на дашборде):
+-- частичный индекс не растёт с историей заказов, и sweeper не перебирает уже истёкшие строки
+DROP INDEX IF EXISTS t_p13776910_data_analytics_solut.idx_orders_expires_at;
+CREATE INDEX IF NOT EXISTS idx_orders_expires_at ON t_p13776910_data_analytics_solut.orders(expires_at)
+    WHERE subscription_status = 'active';
@@ -0,0 +1,5 @@
+-- Счётчик поколения кэшей сессий: выход, смена пароля и правка пользователя сбрасывают
+-- закэшированные сессии в auth, orders и admin, а не только в инстансе, обработавшем запрос
+INSERT INTO t_p13776910_data_analytics_solut.cache_generations (name, generation)
+VALUES ('sessions', 0)
+ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,66 @@
+-- Триггеры дашборда больше не обновляют строку dashboard_stats (id = 1): эта строка оставалась
+-- заблокированной до конца транзакции, и все параллельные регистрации, заказы и подтверждения оплат
+-- выстраивались за одной блокировкой. Теперь каждое изменение пишет отдельную строку-дельту,
+-- get_stats суммирует их с итогом, а admin периодически сворачивает дельты в dashboard_stats
+CREATE TABLE IF NOT EXISTS t_p13776910_data_analytics_solut.dashboard_stats_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    users_delta INTEGER NOT NULL DEFAULT 0,
+    products_delta INTEGER NOT NULL DEFAULT 0,
+    orders_delta INTEGER NOT NULL DEFAULT 0,
+    revenue_delta DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_users() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO t_p13776910_data_analytics_solut.dashboard_stats_deltas (users_delta)
+    VALUES (CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_products() RETURNS TRIGGER AS $$
+DECLARE
+    delta INTEGER := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_active THEN
+        delta := delta + 1;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_active THEN
+        delta := delta - 1;
+    END IF;
+    IF delta <> 0 THEN
+        INSERT INTO t_p13776910_data_analytics_solut.dashboard_stats_deltas (products_delta)
+        VALUES (delta);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p13776910_data_analytics_solut.dashboard_stats_orders() RETURNS TRIGGER AS $$
+DECLARE
+    count_delta INTEGER := 0;
+    revenue_delta DECIMAL(14, 2) := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_OP = 'INSERT' THEN
+            count_delta := count_delta + 1;
+        END IF;
+        IF NEW.status = 'paid' OR NEW.payment_confirmed THEN
+            revenue_delta := revenue_delta + NEW.total_amount;
+        END IF;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF TG_OP = 'DELETE' THEN
+            count_delta := count_delta - 1;
+        END IF;
+        IF OLD.status = 'paid' OR OLD.payment_confirmed THEN
+            revenue_delta := revenue_delta - OLD.total_amount;
+        END IF;
+    END IF;
+    IF count_delta <> 0 OR revenue_delta <> 0 THEN
+        INSERT INTO t_p13776910_data_analytics_solut.dashboard_stats_deltas (orders_delta, revenue_delta)
+        VALUES (count_delta, revenue_delta);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
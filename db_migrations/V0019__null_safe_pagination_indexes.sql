@@ -0,0 +1,15 @@
+-- created_at допускает NULL: админ-панель сортирует и листает по COALESCE(created_at, 'epoch'), id.
+-- Индексы с фильтром пересоздаются по этому выражению; idx_*_created_id без фильтра остаются
+-- для диапазонов по created_at (аналитика, выгрузки), к ним добавляются idx_*_page для keyset
+DROP INDEX IF EXISTS t_p13776910_data_analytics_solut.idx_orders_status_created_id;
+DROP INDEX IF EXISTS t_p13776910_data_analytics_solut.idx_orders_confirmed_created_id;
+DROP INDEX IF EXISTS t_p13776910_data_analytics_solut.idx_orders_product_created_id;
+DROP INDEX IF EXISTS t_p13776910_data_analytics_solut.idx_users_role_created_id;
+
+CREATE INDEX IF NOT EXISTS idx_orders_page ON t_p13776910_data_analytics_solut.orders((COALESCE(created_at, TIMESTAMP 'epoch')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_id ON t_p13776910_data_analytics_solut.orders(status, (COALESCE(created_at, TIMESTAMP 'epoch')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_confirmed_created_id ON t_p13776910_data_analytics_solut.orders(payment_confirmed, (COALESCE(created_at, TIMESTAMP 'epoch')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_product_created_id ON t_p13776910_data_analytics_solut.orders(product_id, (COALESCE(created_at, TIMESTAMP 'epoch')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_page ON t_p13776910_data_analytics_solut.users((COALESCE(created_at, TIMESTAMP 'epoch')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_role_created_id ON t_p13776910_data_analytics_solut.users(role, (COALESCE(created_at, TIMESTAMP 'epoch')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_page ON t_p13776910_data_analytics_solut.products((COALESCE(created_at, TIMESTAMP 'epoch')) DESC, id DESC);
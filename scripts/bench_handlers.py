@@ -0,0 +1,285 @@
+"""Бенчмарк горячих путей функций на локальном Postgres: пропускная способность и p50/p95/p99.
+
+Заполняет БД тестовыми пользователями, продуктами, заказами и сессиями,
+вызывает handler(event, context) в процессе с фиксированной параллельностью
+и пишет результаты в JSON, чтобы сравнивать их между коммитами.
+
+    DATABASE_URL=postgresql://localhost/app python scripts/bench_handlers.py --migrate -o bench.json
+    python scripts/bench_handlers.py -o new.json --compare bench.json --tolerance 0.2
+"""
+import argparse
+import itertools
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import bcrypt
+import psycopg2
+from psycopg2.extras import execute_values
+
+from functions import load_function
+
+MIGRATIONS = Path(__file__).resolve().parent.parent / 'db_migrations'
+SCHEMA = 't_p13776910_data_analytics_solut'
+BENCH_EMAIL = 'bench-{}@bench.local'
+BENCH_CATEGORY = 'bench'
+BENCH_PASSWORD = 'bench-password'
+
+
+def apply_migrations(conn) -> None:
+    """Накатывает db_migrations/V*.sql по порядку на пустую БД"""
+    cursor = conn.cursor()
+    cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+    cursor.execute(f'SET search_path TO {SCHEMA}')
+    for path in sorted(MIGRATIONS.glob('V*.sql'), key=lambda p: int(p.name[1:].split('__')[0])):
+        cursor.execute(path.read_text(encoding='utf-8'))
+    conn.commit()
+    cursor.close()
+
+
+def seed(conn, users: int, products: int, orders_per_user: int) -> dict:
+    """Пересоздаёт тестовые данные бенчмарка и возвращает токены для запросов"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM users WHERE email LIKE %s", (BENCH_EMAIL.format('%'),))
+    old_users = [r[0] for r in cursor.fetchall()]
+    if old_users:
+        cursor.execute("DELETE FROM sessions WHERE user_id = ANY(%s)", (old_users,))
+        cursor.execute("DELETE FROM revoked_access_tokens WHERE order_id IN (SELECT id FROM orders WHERE user_id = ANY(%s))", (old_users,))
+        cursor.execute("DELETE FROM orders WHERE user_id = ANY(%s)", (old_users,))
+        cursor.execute("DELETE FROM users WHERE id = ANY(%s)", (old_users,))
+    cursor.execute("DELETE FROM products WHERE category = %s", (BENCH_CATEGORY,))
+
+    product_ids = [r[0] for r in execute_values(cursor, """
+        INSERT INTO products (title, description, price, category, is_active, website_url, subscription_days)
+        VALUES %s RETURNING id
+    """, [(f'Бенчмарк {i}', 'Продукт для бенчмарка', 1000 + i, BENCH_CATEGORY, True, 'https://example.com', 30)
+          for i in range(products)], fetch=True)]
+
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt(int(os.environ['BCRYPT_ROUNDS']))).decode()
+    user_rows = execute_values(cursor, """
+        INSERT INTO users (email, password_hash, full_name, role) VALUES %s RETURNING id
+    """, [(BENCH_EMAIL.format(i), password_hash, f'Пользователь {i}', 'admin' if i == 0 else 'user')
+          for i in range(users)], fetch=True)
+    user_ids = [r[0] for r in user_rows]
+
+    sessions = {uid: secrets.token_urlsafe(32) for uid in user_ids}
+    execute_values(cursor, """
+        INSERT INTO sessions (user_id, token, expires_at) VALUES %s
+    """, [(uid, token) for uid, token in sessions.items()],
+        template="(%s, %s, NOW() + INTERVAL '1 day')")
+
+    order_rows = []
+    for uid, pid in zip(itertools.chain.from_iterable(itertools.repeat(u, orders_per_user) for u in user_ids),
+                        itertools.cycle(product_ids)):
+        order_rows.append((uid, pid, 1000, secrets.token_urlsafe(32)))
+    execute_values(cursor, """
+        INSERT INTO orders (user_id, product_id, total_amount, status, payment_confirmed, paid_at, expires_at, access_token)
+        VALUES %s
+    """, order_rows, template="(%s, %s, %s, 'completed', TRUE, NOW(), NOW() + INTERVAL '30 days', %s)")
+    conn.commit()
+    cursor.close()
+
+    return {
+        'admin': sessions[user_ids[0]],
+        'sessions': list(sessions.values()),
+        'access_tokens': [row[3] for row in order_rows],
+        'emails': [BENCH_EMAIL.format(i) for i in range(users)],
+        'order_ids': fetch_order_ids(conn, user_ids)
+    }
+
+
+def fetch_order_ids(conn, user_ids: list) -> list:
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM orders WHERE user_id = ANY(%s) ORDER BY id", (user_ids,))
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return ids
+
+
+def scenarios(data: dict) -> dict:
+    """Действие -> (функция, фабрика событий по номеру запроса)"""
+    def get(action, session=None, **params):
+        headers = {'X-Authorization': f'Bearer {session}'} if session else {}
+        return {'httpMethod': 'GET', 'queryStringParameters': {'action': action, **params},
+                'headers': headers, 'body': '', 'isBase64Encoded': False}
+
+    def send(method, action, session, body):
+        return {'httpMethod': method, 'queryStringParameters': {'action': action},
+                'headers': {'X-Authorization': f'Bearer {session}'} if session else {},
+                'body': json.dumps(body), 'isBase64Encoded': False}
+
+    sessions, access_tokens = data['sessions'], data['access_tokens']
+    emails, order_ids = data['emails'], data['order_ids']
+    return {
+        'auth?action=verify': ('auth', lambda i: get('verify', sessions[i % len(sessions)])),
+        'orders?action=my-orders': ('orders', lambda i: get('my-orders', sessions[i % len(sessions)])),
+        'orders?action=check-access': ('orders', lambda i: get('check-access', token=access_tokens[i % len(access_tokens)])),
+        'admin?action=get-orders': ('admin', lambda i: get('get-orders', data['admin'], limit='100')),
+        'products': ('products', lambda i: get('')),
+        'admin?action=analytics': ('admin', lambda i: get('analytics', data['admin'])),
+        'auth?action=login': ('auth', lambda i: send('POST', 'login', None, {
+            'email': emails[i % len(emails)], 'password': BENCH_PASSWORD})),
+        'admin?action=update-order': ('admin', lambda i: send('PUT', 'update-order', data['admin'], {
+            'id': order_ids[i % len(order_ids)], 'status': 'completed', 'notes': 'bench'})),
+    }
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def query_count(response: dict) -> int:
+    """Число запросов к БД из метрики queries заголовка Server-Timing"""
+    for metric in (response.get('headers') or {}).get('Server-Timing', '').split(','):
+        name, _, desc = metric.strip().partition(';desc=')
+        if name == 'queries':
+            return int(desc.strip('"'))
+    return 0
+
+
+def run_scenario(handler, make_event, requests: int, concurrency: int, warmup: int) -> dict:
+    for i in range(warmup):
+        handler(make_event(i), None)
+
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    errors = 0
+    queries = 0
+
+    def worker():
+        nonlocal errors, queries
+        local, failed, round_trips = [], 0, 0
+        while True:
+            i = next(counter)
+            if i >= requests:
+                break
+            started = time.perf_counter()
+            response = handler(make_event(i), None)
+            local.append(time.perf_counter() - started)
+            if response['statusCode'] >= 400:
+                failed += 1
+            round_trips += query_count(response)
+        with lock:
+            latencies.extend(local)
+            errors += failed
+            queries += round_trips
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(requests / elapsed, 1),
+        'queries_per_request': round(queries / requests, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> bool:
+    """Печатает изменение p95 относительно прошлого прогона. False - если есть регрессия больше tolerance"""
+    ok = True
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old or not old['p95_ms']:
+            continue
+        change = result['p95_ms'] / old['p95_ms'] - 1
+        marker = ''
+        if change > tolerance:
+            marker = '  РЕГРЕССИЯ'
+            ok = False
+        print(f'  {name:<28} p95 {old["p95_ms"]:8.2f} -> {result["p95_ms"]:8.2f} мс ({change:+.0%}), '
+              f'запросов {old.get("queries_per_request", "?")} -> {result["queries_per_request"]}{marker}')
+    return ok
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=MIGRATIONS.parent).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--migrate', action='store_true', help='Накатить db_migrations на пустую БД')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--products', type=int, default=20)
+    parser.add_argument('--orders-per-user', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=2000, help='Запросов на каждое действие')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--only', nargs='+', help='Запустить только указанные действия')
+    parser.add_argument('-o', '--output', help='Файл для результатов в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост p95 при сравнении')
+    args = parser.parse_args(argv)
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        print('Не задан DATABASE_URL', file=sys.stderr)
+        return 2
+    # Функции работают без префикса схемы - как в облаке, через search_path
+    os.environ.setdefault('PGOPTIONS', f'-c search_path={SCHEMA},public')
+    os.environ.setdefault('DB_POOL_MAX', str(args.concurrency))
+    # Бенчмарк меряет путь запроса, а не стоимость bcrypt и не ограничение частоты входа
+    os.environ.setdefault('BCRYPT_ROUNDS', '4')
+    os.environ.setdefault('LOGIN_RATE_CAPACITY', '1000000')
+    os.environ['REQUEST_TIMING'] = '1'
+
+    conn = psycopg2.connect(dsn)
+    if args.migrate:
+        apply_migrations(conn)
+    data = seed(conn, args.users, args.products, args.orders_per_user)
+    conn.close()
+
+    handlers = {}
+    results = {}
+    for name, (function, make_event) in scenarios(data).items():
+        if args.only and name not in args.only:
+            continue
+        if function not in handlers:
+            handlers[function] = load_function(function).handler
+        results[name] = run_scenario(handlers[function], make_event, args.requests, args.concurrency, args.warmup)
+        r = results[name]
+        print(f'{name:<28} {r["rps"]:8.1f} rps  {r["queries_per_request"]:5.2f} запр.  p50 {r["p50_ms"]:7.2f}  p95 {r["p95_ms"]:7.2f}  '
+              f'p99 {r["p99_ms"]:7.2f} мс  ошибок {r["errors"]}')
+
+    report = {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'config': {k: getattr(args, k) for k in ('users', 'products', 'orders_per_user', 'requests', 'concurrency', 'warmup')},
+        'results': results
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        print(f'Сравнение с {args.compare} ({baseline.get("revision") or "?"}):')
+        if not compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
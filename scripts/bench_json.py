@@ -0,0 +1,92 @@
+"""Микробенчмарк сериализации ответов: json.dumps(default=str) против json_response из функций.
+
+Строки имитируют то, что RealDictCursor возвращает для admin?action=get-orders
+и products (список каталога): NUMERIC приходит как Decimal, TIMESTAMP - как datetime.
+
+    python scripts/bench_json.py --rows 500 --repeat 200
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from functions import load_function
+
+
+def order_rows(count: int) -> list:
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    return [{
+        'id': i,
+        'user_id': i % 97,
+        'product_id': i % 13,
+        'total_amount': Decimal('14990.00') + i,
+        'status': 'completed',
+        'paid_at': now + timedelta(minutes=i),
+        'expires_at': now + timedelta(days=30, minutes=i),
+        'access_token': f'token-{i:08d}',
+        'payment_confirmed': True,
+        'payment_method': 'sbp',
+        'payment_reference': f'REF-{i}',
+        'notes': None,
+        'created_at': now + timedelta(minutes=i),
+        'user_email': f'user{i}@example.com',
+        'user_name': 'Иван Петров',
+        'product_title': 'Аналитическая панель',
+        'website_url': 'https://example.com/app'
+    } for i in range(count)]
+
+
+def product_rows(count: int) -> list:
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    return [{
+        'id': i,
+        'title': f'Продукт {i}',
+        'description': 'Готовое решение для анализа данных. ' * 4,
+        'price': Decimal('9990.00') + i,
+        'category': 'analytics',
+        'image_url': f'https://cdn.example.com/{i}.png',
+        'demo_url': None,
+        'is_active': True,
+        'created_at': now - timedelta(days=i)
+    } for i in range(count)]
+
+
+def measure(fn, payload, repeat: int) -> float:
+    """Среднее время одного вызова в микросекундах"""
+    fn(payload)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(payload)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    cases = [
+        ('admin get-orders', load_function('admin'), {'orders': order_rows(args.rows), 'next_cursor': None}),
+        ('products list', load_function('products'), {'products': product_rows(args.rows)}),
+    ]
+
+    for title, module, payload in cases:
+        results = {'json.dumps(default=str)': measure(lambda d: json.dumps(d, default=str), payload, args.repeat)}
+        if module.orjson is not None:
+            results['json_response (orjson)'] = measure(lambda d: module.json_response(200, d), payload, args.repeat)
+        encoder, module.orjson = module.orjson, None
+        results['json_response (stdlib)'] = measure(lambda d: module.json_response(200, d), payload, args.repeat)
+        module.orjson = encoder
+
+        baseline = results['json.dumps(default=str)']
+        print(f'{title}, строк: {args.rows}')
+        for name, micros in results.items():
+            print(f'  {name:<26} {micros:10.1f} мкс  x{baseline / micros:.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
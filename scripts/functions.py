@@ -0,0 +1,17 @@
+"""Загрузка облачных функций из backend/<name>/index.py для локального запуска и бенчмарков"""
+import importlib.util
+import os
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTIONS = ('auth', 'orders', 'admin', 'products')
+
+
+def load_function(name: str):
+    """Загружает backend/<name>/index.py как отдельный модуль - так же, как его видит рантайм функции.
+    У каждой функции свой модуль со своим пулом соединений и кэшами."""
+    os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/bench')
+    spec = importlib.util.spec_from_file_location(f'{name}_index', BACKEND / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,137 @@
+"""Локальный HTTP-сервер для облачных функций: /auth, /orders, /admin, /products.
+
+HTTP-запрос переводится в такое же событие, какое передаёт рантайм функции
+(httpMethod, queryStringParameters, headers, body), и отдаётся handler(event, context)
+из backend/<name>/index.py. Запросы выполняются в пуле из --workers потоков,
+так что на локальном Postgres можно давать нагрузку, близкую к реальной.
+Соединения с БД ограничены пулом каждой функции (DB_POOL_MAX), как в облаке.
+
+    DATABASE_URL=postgresql://localhost/app python scripts/local_server.py --port 8000 --workers 16
+"""
+import argparse
+import base64
+import json
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from functions import FUNCTIONS, load_function
+
+
+class Context:
+    """Минимальный аналог контекста вызова функции"""
+
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.request_id = uuid.uuid4().hex
+
+
+def build_event(method: str, path: str, headers: dict, body: bytes) -> dict:
+    url = urlsplit(path)
+    try:
+        text = body.decode('utf-8')
+        encoded = False
+    except UnicodeDecodeError:
+        text = base64.b64encode(body).decode('ascii')
+        encoded = True
+    return {
+        'httpMethod': method,
+        'path': url.path,
+        'queryStringParameters': dict(parse_qsl(url.query, keep_blank_values=True)),
+        'headers': headers,
+        'body': text,
+        'isBase64Encoded': encoded
+    }
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer, который обрабатывает соединения в пуле потоков фиксированного размера"""
+
+    def __init__(self, address, handler_class, handlers: dict, workers: int, quiet: bool = False):
+        super().__init__(address, handler_class)
+        self.handlers = handlers
+        self.quiet = quiet
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class FunctionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_request(self):
+        name = urlsplit(self.path).path.strip('/').split('/', 1)[0]
+        function = self.server.handlers.get(name)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if function is None:
+            return self.send(404, {'Content-Type': 'application/json'}, json.dumps({'error': 'Function not found'}).encode())
+
+        event = build_event(self.command, self.path, dict(self.headers.items()), body)
+        try:
+            response = function(event, Context(name))
+        except Exception as e:
+            return self.send(502, {'Content-Type': 'application/json'}, json.dumps({'error': str(e)}).encode())
+
+        payload = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            payload = base64.b64decode(payload)
+        elif isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        self.send(response.get('statusCode', 200), response.get('headers') or {}, payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_OPTIONS = do_request
+
+    def send(self, status: int, headers: dict, payload: bytes):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, str(value))
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=8, help='Число одновременно выполняемых запросов')
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=list(FUNCTIONS))
+    parser.add_argument('--quiet', action='store_true', help='Не печатать журнал запросов')
+    args = parser.parse_args(argv)
+
+    handlers = {name: load_function(name).handler for name in args.functions}
+    server = PooledHTTPServer((args.host, args.port), FunctionRequestHandler, handlers, args.workers, args.quiet)
+    print(f'http://{args.host}:{args.port}/ -> {", ".join(handlers)} ({args.workers} workers)', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
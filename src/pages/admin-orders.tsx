@@ -1,4 +1,4 @@
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import { useNavigate, Link } from 'react-router-dom'
 import { Button } from '@/components/ui/button'
 import { Input } from '@/components/ui/input'
@@ -6,6 +6,7 @@ import Icon from '@/components/ui/icon'
 import { authService } from '@/lib/auth'
 
 const ADMIN_API_URL = 'https://functions.poehali.dev/60c925e5-07c4-4e22-acbb-7c60c1d9524d'
+const PAGE_SIZE = 100
 
 interface Order {
   id: number
@@ -25,13 +26,33 @@ interface Order {
   created_at: string
 }
 
+// date_to на сервере не включается в период, а в форме выбирается последний день включительно
+const nextDay = (date: string) => {
+  const d = new Date(`${date}T00:00:00Z`)
+  d.setUTCDate(d.getUTCDate() + 1)
+  return d.toISOString().slice(0, 10)
+}
+
+interface ProductOption {
+  id: number
+  title: string
+}
+
 export function AdminOrdersPage() {
   const navigate = useNavigate()
   const [orders, setOrders] = useState<Order[]>([])
-  const [filteredOrders, setFilteredOrders] = useState<Order[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const [ready, setReady] = useState(false)
   const [searchTerm, setSearchTerm] = useState('')
+  const [search, setSearch] = useState('')
   const [statusFilter, setStatusFilter] = useState<string>('all')
+  const [productFilter, setProductFilter] = useState('')
+  const [dateFrom, setDateFrom] = useState('')
+  const [dateTo, setDateTo] = useState('')
+  const [products, setProducts] = useState<ProductOption[]>([])
+  const requestId = useRef(0)
   const [updating, setUpdating] = useState<number | null>(null)
   const [confirmingOrder, setConfirmingOrder] = useState<Order | null>(null)
   const [confirmRef, setConfirmRef] = useState('')
@@ -45,51 +66,71 @@ export function AdminOrdersPage() {
       if (!result.valid || result.user?.role !== 'admin') {
         navigate('/login')
       } else {
-        await loadOrders()
+        setReady(true)
+        await loadProducts()
       }
     }
     verifyAndLoad()
   }, [navigate])
 
   useEffect(() => {
-    let filtered = orders
+    const timer = setTimeout(() => setSearch(searchTerm.trim()), 400)
+    return () => clearTimeout(timer)
+  }, [searchTerm])
 
-    if (statusFilter !== 'all') {
-      if (statusFilter === 'unconfirmed') {
-        filtered = filtered.filter(o => !o.payment_confirmed)
-      } else {
-        filtered = filtered.filter(o => o.status === statusFilter)
-      }
-    }
+  useEffect(() => {
+    if (ready) loadOrders()
+  }, [ready, search, statusFilter, productFilter, dateFrom, dateTo])
 
-    if (searchTerm) {
-      const term = searchTerm.toLowerCase()
-      filtered = filtered.filter(o =>
-        (o.user_email || '').toLowerCase().includes(term) ||
-        (o.user_name || '').toLowerCase().includes(term) ||
-        (o.product_title || '').toLowerCase().includes(term) ||
-        o.id.toString().includes(term)
-      )
+  const loadProducts = async () => {
+    const token = localStorage.getItem('auth_token')
+    try {
+      const params = new URLSearchParams({ action: 'products', limit: '500' })
+      const response = await fetch(`${ADMIN_API_URL}?${params}`, {
+        headers: { 'Authorization': `Bearer ${token}` },
+      })
+      const data = await response.json()
+      setProducts(data.products || [])
+    } catch (error) {
+      console.error('Ошибка загрузки продуктов:', error)
     }
+  }
 
-    setFilteredOrders(filtered)
-  }, [orders, searchTerm, statusFilter])
+  const filterParams = () => {
+    const params = new URLSearchParams({ action: 'get-orders', limit: String(PAGE_SIZE) })
+    if (statusFilter === 'unconfirmed') {
+      params.set('payment_confirmed', 'false')
+    } else if (statusFilter !== 'all') {
+      params.set('status', statusFilter)
+    }
+    if (productFilter) params.set('product_id', productFilter)
+    if (dateFrom) params.set('date_from', dateFrom)
+    if (dateTo) params.set('date_to', nextDay(dateTo))
+    if (search) params.set('search', search)
+    return params
+  }
 
-  const loadOrders = async () => {
+  const loadOrders = async (cursor: string | null = null) => {
     const token = localStorage.getItem('auth_token')
+    const id = ++requestId.current
+    if (cursor) setLoadingMore(true)
     try {
-      const response = await fetch(`${ADMIN_API_URL}?action=get-orders`, {
+      const params = filterParams()
+      if (cursor) params.set('cursor', cursor)
+      const response = await fetch(`${ADMIN_API_URL}?${params}`, {
         headers: { 'Authorization': `Bearer ${token}` },
       })
       const data = await response.json()
-      if (data.orders) {
-        setOrders(data.orders)
-        setFilteredOrders(data.orders)
-      }
+      // Ответ на устаревшие фильтры (пользователь успел их поменять) не показываем
+      if (id !== requestId.current) return
+      const page: Order[] = data.orders || []
+      setOrders(prev => (cursor ? [...prev, ...page] : page))
+      setNextCursor(data.next_cursor || null)
     } catch (error) {
       console.error('Ошибка загрузки заказов:', error)
     } finally {
       setLoading(false)
+      setLoadingMore(false)
     }
   }
 
@@ -282,10 +323,10 @@ export function AdminOrdersPage() {
               <div>
                 <h1 className="font-heading text-3xl font-bold text-white mb-2">Управление заказами</h1>
                 <p className="text-muted-foreground">
-                  Всего заказов: {orders.length}
+                  Показано заказов: {orders.length}{nextCursor ? '+' : ''}
                   {unconfirmedCount > 0 && (
                     <span className="ml-3 px-2 py-0.5 bg-yellow-500/20 text-yellow-400 text-xs rounded-full border border-yellow-500/30">
-                      {unconfirmedCount} ожидают подтверждения
+                      {unconfirmedCount} из показанных ожидают подтверждения
                     </span>
                   )}
                 </p>
@@ -322,28 +363,51 @@ export function AdminOrdersPage() {
                       className={statusFilter === f ? 'bg-primary' : 'border-primary/30'}
                     >
                       {labels[f]}
-                      {f === 'unconfirmed' && unconfirmedCount > 0 && (
-                        <span className="ml-1.5 bg-yellow-500 text-white text-xs rounded-full w-4 h-4 flex items-center justify-center">
-                          {unconfirmedCount}
-                        </span>
-                      )}
                     </Button>
                   )
                 })}
               </div>
             </div>
+            <div className="flex flex-col md:flex-row gap-4 mt-4">
+              <select
+                value={productFilter}
+                onChange={(e) => setProductFilter(e.target.value)}
+                className="flex-1 text-sm bg-background/50 border border-primary/30 rounded-md px-3 py-2 text-white focus:outline-none focus:border-primary"
+              >
+                <option value="">Все продукты</option>
+                {products.map((p) => (
+                  <option key={p.id} value={p.id}>{p.title}</option>
+                ))}
+              </select>
+              <div className="flex items-center gap-2">
+                <span className="text-sm text-muted-foreground">С</span>
+                <Input
+                  type="date"
+                  value={dateFrom}
+                  onChange={(e) => setDateFrom(e.target.value)}
+                  className="bg-background/50 border-primary/30"
+                />
+                <span className="text-sm text-muted-foreground">до</span>
+                <Input
+                  type="date"
+                  value={dateTo}
+                  onChange={(e) => setDateTo(e.target.value)}
+                  className="bg-background/50 border-primary/30"
+                />
+              </div>
+            </div>
           </div>
 
           <div className="space-y-3">
-            {filteredOrders.length === 0 ? (
+            {orders.length === 0 ? (
               <div className="bg-card/50 backdrop-blur-xl border border-primary/20 rounded-2xl p-12 text-center">
                 <Icon name="Package" size={64} className="text-muted-foreground mx-auto mb-4 opacity-50" />
                 <p className="text-muted-foreground text-lg">
-                  {searchTerm || statusFilter !== 'all' ? 'Заказы не найдены' : 'Заказов пока нет'}
+                  {search || statusFilter !== 'all' || productFilter || dateFrom || dateTo ? 'Заказы не найдены' : 'Заказов пока нет'}
                 </p>
               </div>
             ) : (
-              filteredOrders.map((order) => (
+              orders.map((order) => (
                 <div
                   key={order.id}
                   className={`bg-card/50 backdrop-blur-xl border rounded-xl p-5 ${
@@ -438,6 +502,23 @@ export function AdminOrdersPage() {
               ))
             )}
           </div>
+
+          {nextCursor && (
+            <div className="mt-6 text-center">
+              <Button
+                onClick={() => loadOrders(nextCursor)}
+                disabled={loadingMore}
+                variant="outline"
+                className="border-primary/30 hover:bg-primary/10"
+              >
+                {loadingMore ? (
+                  <><Icon name="Loader2" size={16} className="animate-spin mr-2" />Загружаем...</>
+                ) : (
+                  'Загрузить ещё'
+                )}
+              </Button>
+            </div>
+          )}
         </div>
       </div>
     </div>
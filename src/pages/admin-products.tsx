@@ -7,6 +7,7 @@ import { authService } from '@/lib/auth'
 
 const ADMIN_API_URL = 'https://functions.poehali.dev/60c925e5-07c4-4e22-acbb-7c60c1d9524d'
 const UPLOAD_API_URL = 'https://functions.poehali.dev/0dcbc7f5-3b22-4665-a98a-18fb4e1124d2'
+const PAGE_SIZE = 100
 
 interface Upgrade {
   title: string
@@ -33,7 +34,9 @@ interface Product {
 export function AdminProductsPage() {
   const navigate = useNavigate()
   const [products, setProducts] = useState<Product[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [editMode, setEditMode] = useState(false)
   const [editingProduct, setEditingProduct] = useState<Product | null>(null)
   const [formData, setFormData] = useState({
@@ -96,18 +99,24 @@ export function AdminProductsPage() {
     }
   }
 
-  const loadProducts = async () => {
+  const loadProducts = async (cursor: string | null = null) => {
     const token = localStorage.getItem('auth_token')
+    if (cursor) setLoadingMore(true)
     try {
-      const response = await fetch(`${ADMIN_API_URL}?action=products`, {
+      const params = new URLSearchParams({ action: 'products', limit: String(PAGE_SIZE) })
+      if (cursor) params.set('cursor', cursor)
+      const response = await fetch(`${ADMIN_API_URL}?${params}`, {
         headers: { 'Authorization': `Bearer ${token}` },
       })
       const data = await response.json()
-      setProducts(data.products || [])
+      const page: Product[] = data.products || []
+      setProducts(prev => (cursor ? [...prev, ...page] : page))
+      setNextCursor(data.next_cursor || null)
     } catch (error) {
       console.error('Ошибка загрузки продуктов:', error)
     } finally {
       setLoading(false)
+      setLoadingMore(false)
     }
   }
 
@@ -252,7 +261,7 @@ export function AdminProductsPage() {
                   Управление продуктами
                 </h1>
                 <p className="text-muted-foreground">
-                  Всего продуктов: {products.length}
+                  Показано продуктов: {products.length}{nextCursor ? '+' : ''}
                 </p>
               </div>
               <Button
@@ -605,6 +614,23 @@ export function AdminProductsPage() {
               </Button>
             </div>
           )}
+
+          {nextCursor && (
+            <div className="mt-6 text-center">
+              <Button
+                onClick={() => loadProducts(nextCursor)}
+                disabled={loadingMore}
+                variant="outline"
+                className="border-primary/30 hover:bg-primary/10"
+              >
+                {loadingMore ? (
+                  <><Icon name="Loader2" size={16} className="animate-spin mr-2" />Загружаем...</>
+                ) : (
+                  'Загрузить ещё'
+                )}
+              </Button>
+            </div>
+          )}
         </div>
       </div>
     </div>
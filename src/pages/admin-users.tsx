@@ -1,4 +1,4 @@
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import { useNavigate, Link } from 'react-router-dom'
 import { Button } from '@/components/ui/button'
 import { Input } from '@/components/ui/input'
@@ -6,6 +6,7 @@ import Icon from '@/components/ui/icon'
 import { authService } from '@/lib/auth'
 
 const ADMIN_API_URL = 'https://functions.poehali.dev/60c925e5-07c4-4e22-acbb-7c60c1d9524d'
+const PAGE_SIZE = 100
 
 interface User {
   id: number
@@ -20,8 +21,14 @@ interface User {
 export function AdminUsersPage() {
   const navigate = useNavigate()
   const [users, setUsers] = useState<User[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const [ready, setReady] = useState(false)
   const [searchTerm, setSearchTerm] = useState('')
+  const [search, setSearch] = useState('')
+  const [roleFilter, setRoleFilter] = useState('')
+  const requestId = useRef(0)
   const [editingUser, setEditingUser] = useState<User | null>(null)
   const [saving, setSaving] = useState(false)
   const [error, setError] = useState('')
@@ -36,27 +43,47 @@ export function AdminUsersPage() {
       if (!result.valid || result.user?.role !== 'admin') {
         navigate('/login')
       } else {
-        await loadUsers()
+        setReady(true)
       }
     }
 
     verifyAdmin()
   }, [navigate])
 
-  const loadUsers = async () => {
+  useEffect(() => {
+    const timer = setTimeout(() => setSearch(searchTerm.trim()), 400)
+    return () => clearTimeout(timer)
+  }, [searchTerm])
+
+  useEffect(() => {
+    if (ready) loadUsers()
+  }, [ready, search, roleFilter])
+
+  const loadUsers = async (cursor: string | null = null) => {
     const token = localStorage.getItem('auth_token')
+    const id = ++requestId.current
+    if (cursor) setLoadingMore(true)
     try {
-      const response = await fetch(`${ADMIN_API_URL}?action=users`, {
+      const params = new URLSearchParams({ action: 'users', limit: String(PAGE_SIZE) })
+      if (roleFilter) params.set('role', roleFilter)
+      if (search) params.set('search', search)
+      if (cursor) params.set('cursor', cursor)
+      const response = await fetch(`${ADMIN_API_URL}?${params}`, {
         headers: {
           'Authorization': `Bearer ${token}`,
         },
       })
       const data = await response.json()
-      setUsers(data.users || [])
+      // Ответ на устаревшие фильтры (пользователь успел их поменять) не показываем
+      if (id !== requestId.current) return
+      const page: User[] = data.users || []
+      setUsers(prev => (cursor ? [...prev, ...page] : page))
+      setNextCursor(data.next_cursor || null)
     } catch (error) {
       console.error('Ошибка загрузки пользователей:', error)
     } finally {
       setLoading(false)
+      setLoadingMore(false)
     }
   }
 
@@ -142,12 +169,6 @@ export function AdminUsersPage() {
     }
   }
 
-  const filteredUsers = users.filter(user => 
-    user.email.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    user.full_name?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    user.phone?.toLowerCase().includes(searchTerm.toLowerCase())
-  )
-
   if (loading) {
     return (
       <div className="min-h-screen bg-[#0F1419] flex items-center justify-center">
@@ -184,7 +205,7 @@ export function AdminUsersPage() {
                   Управление пользователями
                 </h1>
                 <p className="text-muted-foreground">
-                  Всего пользователей: {users.length}
+                  Показано пользователей: {users.length}{nextCursor ? '+' : ''}
                 </p>
               </div>
             </div>
@@ -196,15 +217,30 @@ export function AdminUsersPage() {
               </div>
             )}
 
-            <div className="relative">
-              <Icon name="Search" size={20} className="absolute left-3 top-1/2 -translate-y-1/2 text-muted-foreground" />
-              <Input
-                type="text"
-                placeholder="Поиск по email, имени или телефону..."
-                value={searchTerm}
-                onChange={(e) => setSearchTerm(e.target.value)}
-                className="pl-10 bg-background/50 border-primary/30 focus:border-primary"
-              />
+            <div className="flex flex-col md:flex-row gap-4">
+              <div className="relative flex-1">
+                <Icon name="Search" size={20} className="absolute left-3 top-1/2 -translate-y-1/2 text-muted-foreground" />
+                <Input
+                  type="text"
+                  placeholder="Поиск по email, имени или телефону..."
+                  value={searchTerm}
+                  onChange={(e) => setSearchTerm(e.target.value)}
+                  className="pl-10 bg-background/50 border-primary/30 focus:border-primary"
+                />
+              </div>
+              <div className="flex gap-2">
+                {[['', 'Все'], ['user', 'Пользователи'], ['admin', 'Администраторы']].map(([role, label]) => (
+                  <Button
+                    key={role}
+                    variant={roleFilter === role ? 'default' : 'outline'}
+                    onClick={() => setRoleFilter(role)}
+                    size="sm"
+                    className={roleFilter === role ? 'bg-primary' : 'border-primary/30'}
+                  >
+                    {label}
+                  </Button>
+                ))}
+              </div>
             </div>
           </div>
 
@@ -224,7 +260,7 @@ export function AdminUsersPage() {
                   </tr>
                 </thead>
                 <tbody>
-                  {filteredUsers.map((user, index) => (
+                  {users.map((user, index) => (
                     <tr 
                       key={user.id}
                       className={`border-b border-primary/10 hover:bg-primary/5 transition-colors ${
@@ -283,16 +319,33 @@ export function AdminUsersPage() {
               </table>
             </div>
 
-            {filteredUsers.length === 0 && (
+            {users.length === 0 && (
               <div className="py-12 text-center">
                 <Icon name="Users" size={48} className="text-muted-foreground mx-auto mb-4" />
                 <p className="text-muted-foreground">
-                  {searchTerm ? 'Пользователи не найдены' : 'Пользователей пока нет'}
+                  {search || roleFilter ? 'Пользователи не найдены' : 'Пользователей пока нет'}
                 </p>
               </div>
             )}
           </div>
 
+          {nextCursor && (
+            <div className="mt-6 text-center">
+              <Button
+                onClick={() => loadUsers(nextCursor)}
+                disabled={loadingMore}
+                variant="outline"
+                className="border-primary/30 hover:bg-primary/10"
+              >
+                {loadingMore ? (
+                  <><Icon name="Loader2" size={16} className="animate-spin mr-2" />Загружаем...</>
+                ) : (
+                  'Загрузить ещё'
+                )}
+              </Button>
+            </div>
+          )}
+
           {editingUser && (
             <div className="fixed inset-0 bg-black/80 backdrop-blur-sm flex items-center justify-center z-50 p-4">
               <div className="bg-card/95 backdrop-blur-xl border border-primary/20 rounded-2xl p-8 max-w-2xl w-full max-h-[90vh] overflow-y-auto">